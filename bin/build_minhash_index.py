@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+import sys
+import logging
+import findmodules
+from opp import minhash, debug
+
+# add documents that were stored before the minhash index existed to
+# the index (see opp/minhash.py)
+
+logger = logging.getLogger('opp')
+logger.setLevel(logging.DEBUG)
+ch = logging.StreamHandler(sys.stdout)
+ch.setLevel(logging.DEBUG)
+logger.addHandler(ch)
+
+debug.debuglevel(2)
+
+num = minhash.build_index()
+print('{} documents added to minhash index'.format(num))
@@ -32,13 +32,14 @@ if args.link:
     b = scraper.Browser()
     b.goto(source.url)
     source.set_html(b.page_source)
-    try:
-        el = b.find_element_by_xpath("//a[contains(@href, '{}')]".format(args.link))
-    except Exception as e:
+    source.extract_links(b)
+    links = [li for li in list(source.new_links) + list(source.old_links)
+             if args.link in li.url]
+    if not links:
         sys.exit('no link containing '+args.link+' on '+source.url)
-    url = source.make_absolute(el.get_attribute('href'))
-    li = scraper.Link(url=url, source=source, element=el)
-    li.load_from_db()
+    li = links[0]
+    if not li.link_id:
+        li.load_from_db()
     scraper.process_link(li, force_reprocess=True, keep_tempfiles=args.keep)
 else:
     scraper.scrape(source, keep_tempfiles=args.keep)
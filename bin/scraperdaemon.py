@@ -5,7 +5,8 @@ import signal
 import logging
 import findmodules
 from opp.config import config
-from opp import scraper, blogpostprocessor, browser
+from opp import blogpostprocessor
+from opp.scraperpool import ScraperPool
 from opp.daemon import Daemon
 from opp.debug import debug, debuglevel
 
@@ -20,6 +21,8 @@ logger.addHandler(fh)
 
 PIDFILE = '/tmp/opp-scraper.pid' 
 
+BLOGCHECK_SECS = 30*60
+
 class GracefulKiller:
     kill_now = False
     def __init__(self):
@@ -38,30 +41,27 @@ class ScraperDaemon(Daemon):
 
     def run(self):
         killer = GracefulKiller()
-        while True:
-            for n in range(200):
-                # one loop takes about 30 minutes (or 3 hours if
-                # there's nothing to do)
-                source = scraper.next_source()
-                if source:
-                    scraper.scrape(source)
-                # wait:
-                pause_secs = 10 if source else 60
-                for sec in range(pause_secs):
-                    if killer.kill_now:
-                        browser.stop_browser()
-                        return
-                    time.sleep(1)
-            # occasionally restart browser and check for blog posts:
-            blogpostprocessor.run()
-            browser.stop_browser()
-            browser.kill_all_browsers()
+        pool = ScraperPool()
+        pool.start()
+        last_blogcheck = time.time()
+        while not killer.kill_now:
+            num_idle = pool.dispatch()
+            # occasionally check for blog posts:
+            if time.time() - last_blogcheck > BLOGCHECK_SECS:
+                blogpostprocessor.run()
+                last_blogcheck = time.time()
+            # wait (longer if there's nothing to do):
+            pause_secs = 60 if num_idle else 2
+            for sec in range(pause_secs):
+                if killer.kill_now:
+                    break
+                time.sleep(1)
+        pool.stop()
             
     def stop(self):
         print("stopping...")
-        # browser.stop_browser() doesn't work here because the daemon
-        # doesn't have access to the relevant _browser instance; but
-        # the function will be called in run() via killer.
+        # The browsers belong to the worker processes of the running
+        # daemon, which stops them in run() via killer.
         super().stop()
 
 if __name__ == "__main__":
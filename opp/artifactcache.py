@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from opp.config import config
+from opp.debug import debug
+
+"""
+On-disk cache for downloaded documents and the results of processing
+them (pdf conversion, pdftohtml/ocr xml, Extractor output), so that
+reprocessing the same bytes doesn't rerun the whole pipeline.
+
+Artifacts are stored under the md5 hash of the document they belong
+to (doc.filehash), in <cachedir>/<hash[:2]>/<hash>/<name>. When the
+cache grows beyond its maximum size, the least recently used entries
+are removed.
+
+Settings are read from config['artifact_cache'] ("dir", "max_mb");
+set max_mb to 0 to disable the cache.
+"""
+
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), 'opp-artifacts')
+DEFAULT_MAX_MB = 2000
+
+# when evicting, shrink the cache to this fraction of its maximum:
+EVICT_TO = 0.8
+
+def settings():
+    s = config.get('artifact_cache', {})
+    return s.get('dir', DEFAULT_DIR), s.get('max_mb', DEFAULT_MAX_MB)
+
+def enabled():
+    return settings()[1] > 0
+
+def file_hash(path):
+    """return md5 hash of file <path>"""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def entry_dir(filehash):
+    return os.path.join(settings()[0], filehash[:2], filehash)
+
+def get(filehash, name, dest=None):
+    """
+    return path to cached artifact <name> for <filehash>, or None. If
+    <dest> is given, the artifact is copied to <dest>, and <dest> is
+    returned.
+    """
+    if not filehash or not enabled():
+        return None
+    path = os.path.join(entry_dir(filehash), name)
+    if not os.path.exists(path):
+        return None
+    debug(3, "artifact cache hit: %s/%s", filehash, name)
+    try:
+        # the mtime of an entry's directory marks its last use:
+        os.utime(entry_dir(filehash))
+        if dest:
+            shutil.copyfile(path, dest)
+            return dest
+    except OSError as e:
+        debug(1, "cannot read %s from artifact cache: %s", path, e)
+        return None
+    return path
+
+def put(filehash, name, srcfile):
+    """store copy of <srcfile> as artifact <name> for <filehash>"""
+    if not filehash or not enabled():
+        return
+    edir = entry_dir(filehash)
+    path = os.path.join(edir, name)
+    if os.path.exists(path):
+        # artifacts never change for a given filehash
+        try:
+            os.utime(edir)
+        except OSError:
+            pass
+        return
+    try:
+        os.makedirs(edir, exist_ok=True)
+        # write to tempfile first so that other processes never see
+        # half-written artifacts:
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        shutil.copyfile(srcfile, tmp)
+        os.replace(tmp, path)
+        os.utime(edir)
+    except OSError as e:
+        debug(1, "cannot store %s in artifact cache: %s", srcfile, e)
+        return
+    debug(3, "stored %s in artifact cache as %s/%s", srcfile, filehash, name)
+    if not hasattr(put, 'size'):
+        put.size = cache_size()
+    put.size += os.path.getsize(path)
+    if put.size > settings()[1] * 1024*1024:
+        put.size = evict()
+
+def get_json(filehash, name):
+    """return cached json-serializable object <name> for <filehash>, or None"""
+    path = get(filehash, name+'.json')
+    if not path:
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        debug(1, "cannot read %s from artifact cache: %s", path, e)
+        return None
+
+def put_json(filehash, name, obj):
+    """store json-serializable <obj> as artifact <name> for <filehash>"""
+    if not filehash or not enabled():
+        return
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.json',
+                                     delete=False) as f:
+        json.dump(obj, f)
+    put(filehash, name+'.json', f.name)
+    os.remove(f.name)
+
+def entries():
+    """return list of (mtime, size, path) for all cache entries"""
+    res = []
+    cachedir = settings()[0]
+    if not os.path.isdir(cachedir):
+        return res
+    for prefix in os.scandir(cachedir):
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                res.append((entry.stat().st_mtime, size, entry.path))
+            except OSError:
+                # removed by another process
+                pass
+    return res
+
+def cache_size():
+    return sum(size for (mtime, size, path) in entries())
+
+def evict():
+    """remove least recently used entries; returns new cache size"""
+    maxsize = settings()[1] * 1024*1024 * EVICT_TO
+    ents = sorted(entries())
+    size = sum(e[1] for e in ents)
+    for (mtime, esize, path) in ents:
+        if size <= maxsize:
+            break
+        debug(3, "removing %s from artifact cache", path)
+        shutil.rmtree(path, ignore_errors=True)
+        size -= esize
+    return size
@@ -2,8 +2,8 @@
 import time, sys, re
 from datetime import datetime
 import requests
-from opp import db
-from opp.models import Doc, categories
+from opp import db, minhash
+from opp.models import Doc, categories, unit_of_work, commit
 from opp.debug import debug
 from opp.docparser import blogpostparser
 from opp.doctyper import classifier
@@ -20,10 +20,11 @@ def run():
     posts = cur.fetchall()
     if not posts:
         return debug(3, "no new blog posts")
-    for id in posts:
-        post = Doc(doc_id=id)
-        post.load_from_db()
-        process_blogpost(post)
+    with unit_of_work():
+        for id in posts:
+            post = Doc(doc_id=id)
+            post.load_from_db()
+            process_blogpost(post)
 
 def process_blogpost(doc):
     """
@@ -78,7 +79,8 @@ def remove_from_db(doc):
     try:
         cur.execute(query, (doc.doc_id,))
         debug(4, cur._last_executed)
-        db.commit()
+        minhash.remove_doc(doc.doc_id)
+        commit()
     except:
         # delete fails if blogpost url is a document that has also
         # been found by the scraper, because then there'll be a Link
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 import os
+import re
+import glob
 import time
+import signal
 import logging
+from collections import defaultdict
 
 from selenium.webdriver import Firefox
 from selenium.webdriver.firefox.options import Options
@@ -14,27 +18,49 @@ if __name__ == '__main__':
     curpath = os.path.abspath(os.path.dirname(__file__))
     libpath = os.path.join(curpath, os.path.pardir)
     sys.path.insert(0, libpath)
+from opp.config import config
 from opp.util import get_http_status
 from opp.exceptions import PageLoadException
 
 logger = logging.getLogger('opp')
 
+# Browsers are recycled after this many page loads or if they use
+# more than this much memory (in MB), whichever comes first:
+MAX_PAGELOADS = config.get('browser', {}).get('max_pageloads', 200)
+MAX_RSS = config.get('browser', {}).get('max_rss_mb', 1500)
+
+# Probing the browser and measuring its memory takes time, so we only
+# do it every this many page loads, and after a page load has failed:
+CHECK_PAGELOADS = config.get('browser', {}).get('check_pageloads', 20)
+
+# attempts to start a browser before giving up:
+START_ATTEMPTS = 3
+
 _browser = None
 
-# use only one instance:
+# use only one instance per process:
 def Browser():
+    """
+    return this process's browser, (re)starting it if it is dead or
+    due for recycling
+    """
     global _browser
+    if _browser and not _browser.healthy():
+        stop_browser()
     if not _browser:
+        _browser = start_browser()
+    return _browser
+
+def start_browser():
+    """start and return a new ActualBrowser, retrying a few times"""
+    for attempt in range(1, START_ATTEMPTS+1):
         try:
-            _browser = ActualBrowser()
+            return ActualBrowser()
         except Exception as e:
             logger.debug('failed to start browser: %s', e)
-            stop_browser()
-            kill_all_browsers()
-            logger.debug('waiting then retrying')
-            time.sleep(100)
-            _browser = ActualBrowser()
-    return _browser
+            if attempt == START_ATTEMPTS:
+                raise
+            time.sleep(2*attempt)
 
 def stop_browser():
     '''quit current _browser if running'''
@@ -43,10 +69,7 @@ def stop_browser():
         logger.debug('no browser running')
     else:
         logger.debug('stopping browser')
-        try:
-            _browser.quit()
-        except Exception as e:
-            logger.debug(e)
+        _browser.stop()
         _browser = None
 
 def kill_all_browsers():
@@ -56,6 +79,29 @@ def kill_all_browsers():
         os.system('killall -9 geckodriver')
     except Exception as e:
         logger.debug(e)
+
+def process_rss(pid):
+    """return memory used by process <pid> and its children, in MB"""
+    children = defaultdict(list)
+    for stat in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(stat) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            children[int(fields[1])].append(int(stat.split('/')[2]))
+        except (OSError, IndexError, ValueError):
+            continue
+    rss = 0
+    pids = [pid]
+    while pids:
+        p = pids.pop()
+        pids.extend(children[p])
+        try:
+            with open('/proc/{}/status'.format(p)) as f:
+                m = re.search(r'VmRSS:\s+(\d+) kB', f.read())
+            rss += int(m.group(1)) if m else 0
+        except OSError:
+            continue
+    return rss / 1024
  
 class ActualBrowser(Firefox):
     
@@ -76,6 +122,56 @@ class ActualBrowser(Firefox):
                         options=options#,
                         #log_path='/tmp/selenium.log'
                         )
+        self.pageloads = 0
+        self.last_check = 0 # value of pageloads at last health check
+        self.failed = False # set if last page load raised an exception
+
+    def is_alive(self):
+        """liveness probe: check if the browser still responds"""
+        try:
+            return self.execute_script('return 1') == 1
+        except Exception as e:
+            logger.debug('browser does not respond: %s', e)
+            return False
+
+    def rss(self):
+        """return memory used by firefox (with content processes), in MB"""
+        pid = self.capabilities.get('moz:processID')
+        return process_rss(pid) if pid else 0
+
+    def healthy(self):
+        """check if browser is alive and not due for recycling"""
+        if self.pageloads >= MAX_PAGELOADS:
+            logger.debug('browser has loaded %s pages; recycling', self.pageloads)
+            return False
+        if not self.failed and self.pageloads - self.last_check < CHECK_PAGELOADS:
+            return True
+        self.last_check = self.pageloads
+        self.failed = False
+        rss = self.rss()
+        if rss > MAX_RSS:
+            logger.debug('browser uses %s MB; recycling', round(rss))
+            return False
+        return self.is_alive()
+
+    def stop(self):
+        """quit browser, killing its processes if it doesn't respond"""
+        pids = [self.capabilities.get('moz:processID')]
+        try:
+            pids.append(self.service.process.pid)
+        except AttributeError:
+            pass
+        try:
+            self.quit()
+        except Exception as e:
+            logger.debug(e)
+        for pid in pids:
+            if not pid:
+                continue
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass # already gone
 
     def goto(self, url, timeout=30):
         """
@@ -86,9 +182,12 @@ class ActualBrowser(Firefox):
         301.
         """
         self.status = 900
+        self.pageloads += 1
         self.set_page_load_timeout(timeout)
         try:
+            self.failed = True
             self.get(url)
+            self.failed = False
         except WebDriverException as e:
             if 'Timeout' in e.msg:
                 self.status = 408
@@ -98,16 +197,11 @@ class ActualBrowser(Firefox):
                 self.status = 905
                 raise PageLoadException(e.msg)
             if 'a connection' in e.msg:
-                # no working browser instance; unfortunately we can't simply
-                # restart the browser because this would destroy self. But we
-                # can kill all running browsers, which should make sure a restart
-                # happens.
-                logger.warn('browser looks dead; killing processes')
-                try:
-                    stop_browser()
-                    kill_all_browsers()
-                except Exception:
-                    pass
+                # no working browser instance; we can't simply restart
+                # the browser because this would destroy self, but the
+                # liveness probe will make sure that it gets replaced
+                # next time it is requested.
+                logger.warn('browser looks dead')
                 self.status = 906
                 raise PageLoadException(e.msg)
             logger.debug("uncaught webdriver exception: {}".format(e.msg))
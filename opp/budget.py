@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import os
+import time
+import signal
+import resource
+import subprocess
+from contextlib import contextmanager
+from opp.config import config
+from opp.debug import debug
+from opp.exceptions import BudgetExceededException
+
+"""
+Per-document processing budget.
+
+Processing a document runs a chain of external tools (pdfinfo,
+pdftohtml, pdftoppm/tesseract, unoconv, the Extractor, ...), each
+with its own timeout. To stop a single bad document from tying up a
+worker for many minutes, all of them share one budget of wall-clock
+time, CPU time and memory:
+
+    with budget.document_budget() as b:
+        process_file(doc)
+
+Inside the with block, tools are run with budget.run() (or use
+budget.step_timeout() for their timeouts), which
+
+- cuts the tool's timeout down to the remaining wall-clock time,
+- starts the tool in its own process group, so that the whole group
+  can be killed,
+- limits its CPU time (RLIMIT_CPU) to the remaining CPU budget and its
+  address space (RLIMIT_AS) to the memory budget; Linux doesn't
+  enforce RLIMIT_RSS, so the address space limit is the nearest
+  available bound. The tool is started under prlimit, which sets the
+  limits before it executes the tool, so they also hold for any
+  processes the tool starts. (Tools started with subprocess.Popen
+  can get the same limits by running budget.limited(cmd).)
+
+Once the budget is used up, every further call raises
+BudgetExceededException, so the rest of the chain is cancelled
+quickly even if intermediate steps catch and convert the exception;
+afterwards b.exceeded() tells whether that is why processing failed.
+Outside of a with block, the tools' own timeouts apply as before.
+
+Settings are read from config['budget'].
+"""
+
+PRLIMIT = '/usr/bin/prlimit'
+
+DEFAULTS = {
+    'wall_secs': 300,   # wall-clock seconds per document
+    'cpu_secs': 240,    # CPU seconds used by the tools we run
+    'max_mem_mb': 2000, # address space of each tool
+}
+
+class Budget():
+
+    def __init__(self, **kwargs):
+        settings = dict(DEFAULTS, **config.get('budget', {}))
+        settings.update(kwargs)
+        self.wall_secs = settings['wall_secs']
+        self.cpu_secs = settings['cpu_secs']
+        self.max_mem_mb = settings['max_mem_mb']
+        self.deadline = time.monotonic() + self.wall_secs
+        self.cpu_start = cpu_time()
+        self.spent = False # set when a tool ran into our limits
+
+    def remaining(self):
+        """remaining wall-clock seconds"""
+        return self.deadline - time.monotonic()
+
+    def cpu_remaining(self):
+        """remaining CPU seconds"""
+        return self.cpu_secs - (cpu_time() - self.cpu_start)
+
+    def exceeded(self):
+        return self.spent or self.remaining() <= 0 or self.cpu_remaining() <= 0
+
+    def check(self):
+        if self.spent:
+            raise BudgetExceededException('processing budget exceeded')
+        if self.remaining() <= 0:
+            raise BudgetExceededException('wall-clock budget of {}s exceeded'.format(self.wall_secs))
+        if self.cpu_remaining() <= 0:
+            raise BudgetExceededException('CPU budget of {}s exceeded'.format(self.cpu_secs))
+
+def cpu_time():
+    """CPU seconds used by the terminated child processes of this process"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+_current = None
+
+@contextmanager
+def document_budget(**kwargs):
+    """run the enclosed block under a new Budget"""
+    global _current
+    previous = _current
+    _current = Budget(**kwargs)
+    try:
+        yield _current
+    finally:
+        _current = previous
+
+def current():
+    return _current
+
+def check():
+    """raise BudgetExceededException if the current budget is used up"""
+    if _current:
+        _current.check()
+
+def step_timeout(default):
+    """
+    return timeout for the next step: <default>, or the remaining
+    wall-clock time if that is less
+    """
+    if not _current:
+        return default
+    _current.check()
+    return min(default, _current.remaining())
+
+def limited(cmd, share=1):
+    """
+    return <cmd> prefixed by a prlimit call that applies the CPU and
+    memory limits of the current budget; <cmd> if there is no budget.
+    If <share> tools run in parallel, each of them gets that share of
+    the remaining CPU time.
+    """
+    if not _current:
+        return cmd
+    cpu = max(int(_current.cpu_remaining() / share) + 1, 1)
+    mem = _current.max_mem_mb * 1024*1024
+    limits = ['--cpu={}:{}'.format(*capped(resource.RLIMIT_CPU, cpu, cpu+5)),
+              '--as={}:{}'.format(*capped(resource.RLIMIT_AS, mem, mem))]
+    return [PRLIMIT] + limits + ['--'] + list(cmd)
+
+def capped(res, soft, hard):
+    """
+    return (<soft>, <hard>) limits for <res>, lowered to its current
+    hard limit (which a process can't raise)
+    """
+    current = resource.getrlimit(res)[1]
+    if current != resource.RLIM_INFINITY:
+        hard = min(hard, current)
+        soft = min(soft, hard)
+    return (soft, hard)
+
+def killpg(proc):
+    """kill the process group of <proc> (started with start_new_session)"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    proc.wait()
+
+def run(cmd, timeout=None, input=None, check=False, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, env=None):
+    """
+    like subprocess.run, but within the current budget; raises
+    BudgetExceededException if the budget runs out while <cmd> is
+    running.
+    """
+    if timeout:
+        timeout = step_timeout(timeout)
+    proc = subprocess.Popen(limited(cmd), stdin=subprocess.PIPE if input is not None else None,
+                            stdout=stdout, stderr=stderr, env=env,
+                            start_new_session=True)
+    try:
+        out, err = proc.communicate(input, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        killpg(proc)
+        check_exceeded(cmd)
+        raise
+    except:
+        killpg(proc)
+        raise
+    if proc.returncode == -signal.SIGXCPU and _current:
+        # the process ran into the CPU limit set by limited()
+        debug(1, "processing budget exceeded by %s", cmd[0])
+        _current.spent = True
+        raise BudgetExceededException('CPU budget of {}s exceeded'.format(_current.cpu_secs))
+    if proc.returncode == -signal.SIGKILL:
+        check_exceeded(cmd)
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, out, err)
+    return subprocess.CompletedProcess(cmd, proc.returncode, out, err)
+
+def check_exceeded(cmd):
+    if _current and _current.exceeded():
+        debug(1, "processing budget exceeded by %s", cmd[0])
+        _current.check()
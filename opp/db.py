@@ -1,37 +1,135 @@
 #!/usr/bin/env python3
+import os
+import time
+import threading
 import MySQLdb
 import MySQLdb.cursors
 from .config import config
-import logging
+from .debug import debug
 
-_conn = None
+"""
+MySQL connections.
 
-def connect(host=config['mysql']['host'],
-            db=config['mysql']['db'],
-            user=config['mysql']['user'],
-            passwd=config['mysql']['pass']):
-    global _conn
-    if not _conn or not _conn.open:
-        _conn = MySQLdb.connect(host=host, db=db, user=user, passwd=passwd,
-                                use_unicode=True, charset='UTF8')
-    return _conn
+Connections are kept in a pool. Each thread checks out its own
+connection the first time it needs one (via connection(), cursor()
+etc.) and keeps it until it calls release() or close(), so threads
+never share a connection. The character set is configured when a
+connection is opened, so creating a cursor costs no round trip to the
+server. A connection that has been idle for a while is pinged before
+it is handed out again, and replaced if the server has gone away.
+
+The pool belongs to the process that created it; after a fork, the
+child opens new connections (but the parent should still close its
+connections before forking, see scraperpool).
+
+Settings are read from config['mysql'] ("pool_size": number of idle
+connections to keep).
+"""
+
+# ping connections that have been idle for longer than this many seconds:
+PING_AFTER = 60
+
+_params = {
+    'host': config['mysql']['host'],
+    'db': config['mysql']['db'],
+    'user': config['mysql']['user'],
+    'passwd': config['mysql']['pass'],
+}
+
+def connect(**kwargs):
+    """open and return a new connection"""
+    params = dict(_params, **kwargs)
+    debug(4, "opening db connection to %s", params['db'])
+    return MySQLdb.connect(use_unicode=True, charset='utf8mb4', **params)
+
+class ConnectionPool():
+
+    def __init__(self, size=None):
+        self.size = size or config['mysql'].get('pool_size', 5)
+        self.idle = [] # (connection, time of last use)
+        self.lock = threading.Lock()
+
+    def get(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, last_used = self.idle.pop()
+            if usable(conn, last_used):
+                return conn
+        return connect()
+
+    def put(self, conn):
+        if not conn.open:
+            return
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, last_used in idle:
+            conn.close()
+
+def usable(conn, last_used):
+    """check if <conn> (last used at <last_used>) can be used"""
+    if not conn.open:
+        return False
+    if time.time() - last_used < PING_AFTER:
+        return True
+    try:
+        conn.ping()
+        return True
+    except MySQLdb.Error:
+        debug(3, "db connection gone, reconnecting")
+        return False
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+def pool():
+    """return the connection pool of this process"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool()
+            _pool_pid = os.getpid()
+            _local.__dict__.clear()
+        return _pool
+
+def connection(**kwargs):
+    """
+    return the current thread's connection. Keyword arguments (host,
+    db, user, passwd) change the connection parameters for all
+    connections opened from now on, e.g. connection(db='test_opp').
+    """
+    if kwargs and any(_params.get(k) != v for k,v in kwargs.items()):
+        close()
+        _params.update(kwargs)
+    p = pool()
+    conn = getattr(_local, 'conn', None)
+    if conn is None or not usable(conn, _local.last_used):
+        conn = p.get()
+        _local.conn = conn
+    _local.last_used = time.time()
+    return conn
 
 def cursor(use_dict=False, retry=False):
     # not cached so we can reconnect if db connection is gone
     try:
         if use_dict:
-            cur = connect().cursor(MySQLdb.cursors.DictCursor)
+            return connection().cursor(MySQLdb.cursors.DictCursor)
         else:
-            cur = connect().cursor()
-            cur.execute("SET NAMES utf8mb4")
-            cur.execute("SET CHARACTER SET utf8mb4")
-            cur.execute("SET character_set_connection=utf8mb4")
-        return cur
-    except:
+            return connection().cursor()
+    except MySQLdb.Error:
         # Lost connection to MySQL server
         if not retry:
-            global _conn
-            _conn = None
+            discard()
             return cursor(use_dict=use_dict, retry=True)
         else:
             raise
@@ -40,10 +138,32 @@ def dict_cursor():
     return cursor(use_dict=True)
 
 def commit():
-    global _conn
-    _conn.commit()
+    connection().commit()
+
+def rollback():
+    connection().rollback()
+
+def release():
+    """return the current thread's connection to the pool"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        if _pool_pid == os.getpid():
+            pool().put(conn)
+
+def discard():
+    """drop the current thread's connection (e.g. after an error)"""
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
 
 def close():
-    global _conn
-    if _conn:
-        _conn.close()
+    """close the current thread's connection and all idle connections"""
+    discard()
+    with _pool_lock:
+        if _pool and _pool_pid == os.getpid():
+            _pool.close()
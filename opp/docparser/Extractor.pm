@@ -1,7 +1,6 @@
 package Extractor;
 use strict;
 use warnings;
-use Memoize;
 use List::Util qw/min max reduce first/;
 use Statistics::Lite 'stddev';
 use Text::Names qw/samePerson parseNames reverseName/;
@@ -12,7 +11,7 @@ use Encode;
 use JSON;
 use FindBin;
 use lib "$FindBin::Bin/.";
-use util::Functools 'allof';
+use util::Functools qw/allof flush_caches/;
 use util::Io;
 use util::String;
 use util::Estimator 'makeLabeler';
@@ -101,7 +100,10 @@ sub removelink {
 }
 
 sub init {
-    my ($self, $xmlfile) = @_;
+    # $context (optional) is a hashref with url, anchortext,
+    # linkcontext, sourceauthor and sourcecontent; otherwise these are
+    # read from the xml file (see paperparser.enrich_xml)
+    my ($self, $xmlfile, $context) = @_;
     say(3, "\ninitialising Extractor: $xmlfile");
 
     $self->{xmlfile} = $xmlfile;
@@ -129,6 +131,12 @@ sub init {
     if ($xml =~ /<url>(.+?)<\/url>/s) {
         $self->{url} = $1;
     }
+    if ($context) {
+        foreach (qw/url anchortext linkcontext sourcecontent/) {
+            $self->{$_} = $context->{$_} if defined $context->{$_};
+        }
+        $self->{sourceauthors} = [ $context->{sourceauthor} ] if $context->{sourceauthor};
+    }
 
     say(3, "collecting text chunks");
 
@@ -819,7 +827,8 @@ sub parsing_evaluator {
         my $parsing = shift;
         foreach my $block (@{$parsing->{blocks}}) {
             next if $block->{p};
-            $block->{p} = memoize($labeler->($block));
+            # (the labeler caches its values per label)
+            $block->{p} = $labeler->($block);
         }
         return $estim->test($parsing);
     }
@@ -1301,10 +1310,64 @@ sub serialize {
     return encode_json(\%doc);
 }
 
+# Server mode, used by extractorpool.py: read jobs from STDIN, one
+# JSON object per line, e.g. {"xmlfile":"/tmp/x.xml","verbosity":1},
+# and for each job print a line {"result":{...},"log":"..."} or
+# {"error":"...","log":"..."}. This saves the cost of starting perl
+# and loading all modules for every document.
+#
+# A job may have a "context" with the link's url, anchortext and
+# linkcontext, and a "source" with the sourceauthor and sourcecontent
+# of the source page. The source is remembered for subsequent jobs,
+# so it only needs to be sent when it changes.
+sub serve {
+    my $json = JSON->new->utf8->allow_nonref;
+    my $source = {};
+    $| = 1;
+    while (my $line = <STDIN>) {
+        next unless $line =~ /\S/;
+        my $log = '';
+        my ($res, $err);
+        eval {
+            my $job = decode_json($line);
+            # cached feature values belong to the previous document:
+            flush_caches();
+            $source = $job->{source} if $job->{source};
+            my $context = { %$source, %{$job->{context} || {}} };
+            # capture debugging output printed by say():
+            open(my $logfh, '>:encoding(UTF-8)', \$log) or die "cannot capture log: $!";
+            my $stdout = select($logfh);
+            eval {
+                my $ex = Extractor->new();
+                $ex->verbosity($job->{verbosity} || 0);
+                $ex->init($job->{xmlfile}, $context);
+                $ex->extract(qw/authors title abstract/);
+                $res = $ex->serialize();
+            };
+            $err = $@;
+            select($stdout);
+            close($logfh);
+        };
+        $err ||= $@;
+        $log = decode('UTF-8', $log, Encode::FB_DEFAULT);
+        if ($res) {
+            print '{"result":', $res, ',"log":', $json->encode($log), "}\n";
+        }
+        else {
+            print '{"error":', $json->encode("$err" || 'no result'),
+                  ',"log":', $json->encode($log), "}\n";
+        }
+    }
+}
+
 # standalone use:
 unless (caller) {
     my %opts;
-    getopts("v:", \%opts);
+    getopts("v:s", \%opts);
+    if ($opts{s}) {
+        serve();
+        exit;
+    }
     my $xmlfile = $ARGV[0];
     die 'need xmlfile argument' unless $xmlfile;
     my $ex = Extractor->new();
@@ -1,10 +1,10 @@
 import re
-import requests
 import lxml.html
 from lxml import etree
 from lxml.html.clean import Cleaner
 from nltk.tokenize import sent_tokenize
 from opp.debug import debug
+from opp.util import session
 
 #
 # Note (2015-09-11):
@@ -35,7 +35,7 @@ def parse(doc):
     authors, abstract, numwords
     """
     debug(3, "fetching blog post %s", doc.url)
-    bytehtml = requests.get(doc.url).content.decode('utf-8', 'ignore')
+    bytehtml = session().get(doc.url, timeout=20).content.decode('utf-8', 'ignore')
     doc.content = extract_content(bytehtml, doc) or strip_tags(doc.content)
     doc.numwords = len(doc.content.split())
     doc.abstract = get_abstract(doc.content)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import queue
+import select
+import atexit
+import threading
+import subprocess
+from os.path import abspath, dirname, join
+from opp.config import config
+from opp.debug import debug, debuglevel
+from opp import budget
+from opp.exceptions import ExtractorTimeoutException, BudgetExceededException
+
+"""
+Pool of resident perl Extractor processes.
+
+Starting perl and compiling Extractor.pm with all its modules takes
+longer than many extraction jobs. So we keep a few Extractor
+processes running in server mode (Extractor.pm -s), send them jobs
+as lines of JSON on stdin and read the results (also one line of
+JSON) from stdout. A worker that doesn't answer in time is killed;
+workers are also replaced after a number of jobs, in case they leak
+memory.
+
+Every process has its own pool. A scraper process extracts one
+document at a time, so one worker is enough there; more only help if
+a process runs the Extractor from several threads.
+
+Settings are read from config['extractor'].
+"""
+
+PERL = '/usr/bin/perl'
+EXTRACTOR = join(abspath(dirname(__file__)), 'Extractor.pm')
+
+DEFAULTS = {
+    'workers': 1,     # number of perl processes (per scraper process)
+    'timeout': 60,    # seconds per job
+    'max_jobs': 200,  # replace worker after this many jobs
+}
+
+class Worker():
+    """a perl Extractor process in server mode"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.process = None
+        self.jobs = 0
+        self.buffer = b''
+        self.source_key = None # source context the process knows
+
+    def start(self):
+        cmd = [PERL, EXTRACTOR, '-s']
+        debug(3, ' '.join(cmd))
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self.jobs = 0
+        self.buffer = b''
+        self.source_key = None
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def run(self, xmlfile, context=None, source=None, source_key=None):
+        """
+        process <xmlfile>; returns (result, log), where result is a
+        dict or None if the Extractor failed. See extract() for the
+        other arguments.
+        """
+        if (not self.process or self.process.poll() is not None
+            or self.jobs >= self.settings['max_jobs']):
+            self.stop()
+            self.start()
+        timeout = budget.step_timeout(self.settings['timeout'])
+        self.jobs += 1
+        job = { 'xmlfile': xmlfile, 'verbosity': debuglevel(), 'context': context }
+        if source and source_key != self.source_key:
+            job['source'] = source
+            self.source_key = source_key
+        job = json.dumps(job)
+        try:
+            self.process.stdin.write(job.encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+            line = self.readline(timeout)
+        except (OSError, ExtractorTimeoutException):
+            self.stop()
+            raise
+        try:
+            res = json.loads(line.decode('utf-8'))
+            if not isinstance(res, dict):
+                raise ValueError('unexpected reply: {}'.format(line[:100]))
+        except ValueError:
+            # we don't know where the worker's next reply starts, so
+            # it can't be used for further jobs:
+            self.stop()
+            raise
+        if 'error' in res:
+            debug(1, 'Extractor error: %s', res['error'])
+        return res.get('result'), res.get('log', '')
+
+    def readline(self, timeout):
+        """read line from worker's stdout, waiting at most <timeout> seconds"""
+        deadline = time.time() + timeout
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self.buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise ExtractorTimeoutException()
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise OSError('Extractor process died')
+                self.buffer += chunk
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line
+
+class ExtractorPool():
+
+    def __init__(self, **kwargs):
+        self.settings = dict(DEFAULTS, **config.get('extractor', {}))
+        self.settings.update(kwargs)
+        self.workers = []
+        self.idle = queue.Queue()
+        for i in range(self.settings['workers']):
+            worker = Worker(self.settings)
+            self.workers.append(worker)
+            self.idle.put(worker)
+
+    def extract(self, xmlfile, context=None, source=None, source_key=None):
+        """
+        run Extractor on <xmlfile>, returns dict of extracted metadata or
+        False on failure. <context> is a dict with the link's url,
+        anchortext and linkcontext, <source> a dict with the
+        sourceauthor and sourcecontent of the source page; <source> is
+        only sent to the worker process if it doesn't already have the
+        source with key <source_key>.
+        """
+        worker = self.idle.get()
+        try:
+            res, log = worker.run(xmlfile, context, source, source_key)
+        except ExtractorTimeoutException:
+            debug(1, 'Extractor timeout!')
+            budget.check()
+            return False
+        except BudgetExceededException:
+            raise
+        except Exception as e:
+            debug(1, 'Extractor failed: %s', e)
+            return False
+        finally:
+            self.idle.put(worker)
+        debug(1, log)
+        return res or False
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def pool():
+    """return the extractor pool of this process"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ExtractorPool()
+            _pool_pid = os.getpid()
+        return _pool
+
+def extract(xmlfile, context=None, source=None, source_key=None):
+    return pool().extract(xmlfile, context, source, source_key)
+
+def stop_workers():
+    global _pool
+    with _pool_lock:
+        if _pool and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+atexit.register(stop_workers)
@@ -3,15 +3,14 @@ import logging
 import re
 import os
 from os.path import abspath, dirname, join
-import subprocess
 import json
-from opp.pdftools.pdftools import pdfcut
+import hashlib
+from opp import artifactcache
+from opp.docparser import extractorpool
 from opp.pdftools.pdf2xml import pdf2xml
-from opp.pdftools.ocr2xml import ocr2xml
+from opp.pdftools.ocr2xml import ocr2xml, pages_in_ranges
 from opp.debug import debug, debuglevel
 
-PERL = '/usr/bin/perl'
-
 logger = logging.getLogger('opp')
 path = abspath(dirname(__file__))
 
@@ -21,13 +20,8 @@ def parse(doc, keep_tempfiles=False):
     extracted from the associated xml file; may create tempfiles for ocr
     """
     xmlfile = doc.xmlfile
-    # We have to pass all relevant information about the Doc object to
-    # the perl Extractor. We do that by adding it to the xml
-    # file. (This is a hopefully temporary hack that makes the xml
-    # invalid.)
-    enrich_xml(xmlfile, doc)
     OCR_IF_CONFIDENCE_BELOW = 0.1
-    parse1 = extractor(xmlfile)
+    parse1 = extractor(xmlfile, doc)
     if parse1:
         # add the Perl output to the Doc object:
         enrich_doc(doc, parse1)
@@ -50,23 +44,17 @@ def parse(doc, keep_tempfiles=False):
         # may need to skip lengthy toc, table of figures, etc. before
         # reaching normal content to figure out default fontsize etc.: 
         ocr_ranges = [(1,4),(20,23)]
-    shortened_pdf = doc.tempfile.rsplit('.')[0] + '-short.pdf'
+    ocr_pages = [p for p in pages_in_ranges(ocr_ranges) if p <= doc.numpages]
     shortened_xml = doc.tempfile.rsplit('.')[0] + '-short.xml'
-    try:
-        pdfcut(doc.tempfile, shortened_pdf, ocr_ranges)
-    except Exception as e:
-        debug(1, 'pdfcut failed, sticking with pdftohtml results: %s', e)
-        # stick with pdftohtml results, so return value is True
-        return True
-    try:
-        ocr2xml(shortened_pdf, shortened_xml, keep_tempfiles=keep_tempfiles)
-    except Exception as e:
-        debug(1, 'ocr failed, sticking with pdftohtml results: %s', e)
-        if not keep_tempfiles:
-            os.remove(shortened_pdf)
-        return True
-    enrich_xml(shortened_xml, doc)
-    parse2 = extractor(shortened_xml)
+    if not artifactcache.get(doc.filehash, 'ocr-short.xml', dest=shortened_xml):
+        try:
+            ocr2xml(doc.tempfile, shortened_xml, pages=ocr_pages)
+        except Exception as e:
+            debug(1, 'ocr failed, sticking with pdftohtml results: %s', e)
+            # stick with pdftohtml results, so return value is True
+            return True
+        artifactcache.put(doc.filehash, 'ocr-short.xml', shortened_xml)
+    parse2 = extractor(shortened_xml, doc)
     if parse2 and parse1:
         # compare results:
         same_authors = (parse1['authors'] == parse2['authors'])
@@ -99,38 +87,73 @@ def parse(doc, keep_tempfiles=False):
     else:
         # This should never happen
         logger.warning('extractor failed on %s (ocr-ed), giving up', doc.url)
-        os.remove(shortened_pdf)
         return True
     if not keep_tempfiles:
-        os.remove(shortened_pdf)
         os.remove(shortened_xml)
     return True
     
-def extractor(xmlfile):
-    cmd = [PERL, join(path, 'Extractor.pm'), "-v{}".format(debuglevel()), xmlfile]
-    debug(2, ' '.join(cmd))
-    try:
-        output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, timeout=60)
-        output = output.decode('utf-8', 'ignore')
-    except subprocess.CalledProcessError as e:
-        debug(1, e.output)
-        return False
-    except subprocess.TimeoutExpired as e:
-        debug(1, 'Extractor timeout!')
-        return False
-    json_separator = '=========== RESULT ===========\n'
-    if not json_separator in output:
-        debug(1, 'Extractor failed:\n%s', output)
-        return False
-    log,jsonstr = output.split(json_separator, 1)
-    debug(1, log)
-    res = json.loads(jsonstr)
+def extractor(xmlfile, doc=None):
+    """
+    run perl Extractor on <xmlfile>; returns dict of extracted
+    metadata, or False on failure. The Extractor also needs to know
+    about the link and source page of Doc object <doc>; if <doc> is
+    None, this information is read from the xml file (see
+    enrich_xml).
+    """
+    context, source, source_key = extractor_context(doc)
+    # The result only depends on the xml, the context and the
+    # Extractor code, so we cache it under the hash of these:
+    md5 = hashlib.md5(extractor_version().encode())
+    with open(xmlfile, 'rb') as f:
+        md5.update(f.read())
+    md5.update(json.dumps([context, source], sort_keys=True).encode('utf-8'))
+    cache_key = md5.hexdigest()
+    res = artifactcache.get_json(cache_key, 'extractor')
+    if res is not None:
+        return res
+    res = run_extractor(xmlfile, context, source, source_key)
+    if res:
+        artifactcache.put_json(cache_key, 'extractor', res)
     return res
 
+def extractor_context(doc):
+    """
+    returns (context, source, source_key) to pass to the Extractor for
+    <doc>: context is information about the link, source about the
+    source page, which only needs to be sent once per source
+    """
+    if not doc:
+        return None, None, None
+    context = {
+        'url': doc.url,
+        'anchortext': doc.link.anchortext or '',
+        'linkcontext': doc.link.context or '',
+        'sourceauthor': doc.default_author or '',
+    }
+    source = { 'sourcecontent': doc.source.text() or '' }
+    return context, source, doc.source.url
+
+def extractor_version():
+    """returns string that changes whenever Extractor.pm or its modules change"""
+    if not hasattr(extractor_version, 'version'):
+        mtimes = [os.path.getmtime(join(path, 'Extractor.pm'))]
+        for d in ('rules', 'util'):
+            for root, dirs, files in os.walk(join(path, d)):
+                mtimes.extend(os.path.getmtime(join(root, f)) for f in files)
+        extractor_version.version = str(max(mtimes))
+    return extractor_version.version
+
+def run_extractor(xmlfile, context=None, source=None, source_key=None):
+    # the Extractor runs in resident perl processes, see extractorpool.py:
+    debug(2, 'running Extractor on %s', xmlfile)
+    return extractorpool.extract(xmlfile, context, source, source_key)
+
 def enrich_xml(xmlfile, doc):
     """
     add doc properties to xmlfile produced by htmltopdf (or ocr2xml)
-    for processing by the Perl metadata extractor
+    for processing by the Perl metadata extractor; only needed if
+    Extractor.pm is called from the command-line, as the scraper
+    passes this information via extractorpool
     """
     def mk_el(tag, content):
         return '<{}>{}</{}>'.format(tag, content or '', tag)
@@ -3,7 +3,7 @@ use strict;
 use warnings;
 use List::Util qw/min max reduce/;
 use Statistics::Lite qw/mean/;
-use Memoize;
+use util::Functools 'memoize';
 use util::String;
 use rules::Helper;
 use rules::Keywords;
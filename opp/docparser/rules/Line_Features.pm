@@ -4,10 +4,9 @@ use strict;
 use File::Basename;
 use Cwd 'abs_path';
 use String::Approx 'amatch';
-use Memoize;
 use List::Util qw/min max reduce/;
 use Lingua::Stem::Snowball;
-use util::Functools qw/someof allof/;
+use util::Functools qw/someof allof memoize/;
 use util::String;
 use rules::Helper;
 use rules::NameExtractor;
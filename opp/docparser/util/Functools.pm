@@ -4,7 +4,7 @@ use warnings;
 use List::Util qw/min max/;
 use Exporter;
 our @ISA = ('Exporter');
-our @EXPORT_OK = qw/&reduce &someof &allof/;
+our @EXPORT_OK = qw/&reduce &someof &allof &memoize &flush_caches/;
 
 sub reduce {
     # This does exactly the same thing as List::Util::reduce, except
@@ -49,3 +49,33 @@ sub allof {
 	return $res;
     }
 }
+
+# Memoize.pm keeps its caches for the lifetime of the process and
+# keys them on the stringified arguments, e.g. HASH(0x55...) for a
+# chunk. In server mode (Extractor.pm -s), the chunks of one document
+# are freed and their addresses reused for the next document, so the
+# feature functions on chunks use this memoize instead: each job
+# starts with flush_caches(), which empties all caches.
+my $generation = 0;
+
+sub memoize {
+    # returns a caching version of $code (called in scalar context)
+    my $code = shift;
+    my %cache;
+    my $cache_generation = $generation;
+    return sub {
+	if ($cache_generation != $generation) {
+	    %cache = ();
+	    $cache_generation = $generation;
+	}
+	my $key = join chr(28), map { defined($_) ? $_ : '' } @_;
+	$cache{$key} = $code->(@_) unless exists $cache{$key};
+	return $cache{$key};
+    }
+}
+
+sub flush_caches {
+    $generation++;
+}
+
+1;
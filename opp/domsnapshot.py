@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+import re
+from html import escape
+
+"""
+Snapshots of a page's DOM, with layout information.
+
+Walking the DOM through selenium costs a WebDriver round trip for
+every attribute we look at. Instead, we serialize the whole DOM
+(including each element's height and vertical position) with a
+single script execution and then work on the snapshot in python.
+Snapshots can also be made from lxml documents, for pages that were
+fetched without the browser; these have no layout information.
+"""
+
+# Each element is turned into an array [tag, attributes, height, top,
+# link, child, child, ...], where text children are strings and link
+# is null except for <a> elements, for which it holds the resolved
+# href, the rendered text, whether the link is visible, and its
+# bounding box:
+SNAPSHOT_JS = """
+function snap(el) {
+    var attrs = [];
+    for (var i = 0; i < el.attributes.length; i++) {
+        attrs.push([el.attributes[i].name, el.attributes[i].value]);
+    }
+    var rect = el.getBoundingClientRect();
+    var top = Math.round(rect.top + window.scrollY);
+    var link = null;
+    if (el.tagName.toLowerCase() == 'a') {
+        var style = window.getComputedStyle(el);
+        link = {
+            href: typeof el.href == 'string' ? el.href : null,
+            text: el.innerText || '',
+            visible: (rect.width > 0 || rect.height > 0 || el.getClientRects().length > 0)
+                     && style.visibility != 'hidden' && style.display != 'none',
+            box: [Math.round(rect.left + window.scrollX), top,
+                  Math.round(rect.width), Math.round(rect.height)]
+        };
+    }
+    var res = [el.tagName.toLowerCase(), attrs, el.offsetHeight || 0, top, link];
+    for (var c = el.firstChild; c; c = c.nextSibling) {
+        if (c.nodeType == 1) res.push(snap(c));
+        else if (c.nodeType == 3) res.push(c.nodeValue);
+    }
+    return res;
+}
+return snap(document.documentElement);
+"""
+
+# script to retrieve the i-th <a> element as WebElement:
+ANCHOR_JS = "return document.getElementsByTagName('a')[arguments[0]];"
+
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr'
+}
+
+RAW_TEXT_ELEMENTS = {'script', 'style'}
+
+class DomNode():
+    """an element in a DomSnapshot"""
+
+    def __init__(self, tag, attrs, height=0, top=0, parent=None):
+        self.tag = tag
+        self.attrs = attrs # list of (name, value) pairs
+        self.height = height
+        self.top = top
+        self.parent = parent
+        self.children = [] # DomNodes and strings
+        self.link = None # for <a> elements: href, text, visible, box
+        self._text = None
+        self._outer_html = None
+
+    def __repr__(self):
+        return '<DomNode {}>'.format(self.tag)
+
+    def get(self, name, default=None):
+        """return value of attribute <name>"""
+        for (k, v) in self.attrs:
+            if k == name:
+                return v
+        return default
+
+    @property
+    def elements(self):
+        """child elements (without text nodes)"""
+        return [c for c in self.children if isinstance(c, DomNode)]
+
+    def iter(self, tag=None):
+        """iterate over descendant elements (in document order), optionally of given tag"""
+        for c in self.children:
+            if isinstance(c, DomNode):
+                if tag is None or c.tag == tag:
+                    yield c
+                yield from c.iter(tag)
+
+    def ancestors(self):
+        node = self.parent
+        while node:
+            yield node
+            node = node.parent
+
+    def text(self):
+        """return text content, like the DOM's textContent"""
+        if self._text is None:
+            self._text = ''.join(c if isinstance(c, str) else c.text()
+                                 for c in self.children)
+        return self._text
+
+    def outer_html(self):
+        """return html source of element, like the DOM's outerHTML"""
+        if self._outer_html is None:
+            attrs = ''.join(' {}="{}"'.format(k, escape(v, quote=True))
+                            for (k,v) in self.attrs)
+            start = '<{}{}>'.format(self.tag, attrs)
+            if self.tag in VOID_ELEMENTS:
+                self._outer_html = start
+            else:
+                inner = ''.join(
+                    c.outer_html() if isinstance(c, DomNode)
+                    else (c if self.tag in RAW_TEXT_ELEMENTS else escape(c, quote=False))
+                    for c in self.children)
+                self._outer_html = '{}{}</{}>'.format(start, inner, self.tag)
+        return self._outer_html
+
+    def is_hidden(self):
+        """guess if element is invisible (based on markup only)"""
+        for node in [self] + list(self.ancestors()):
+            if node.tag in ('script', 'noscript', 'template', 'head'):
+                return True
+            if node.get('hidden') is not None:
+                return True
+            if re.search(r'display:\s*none|visibility:\s*hidden', node.get('style', '')):
+                return True
+        return False
+
+class DomSnapshot():
+
+    def __init__(self, root):
+        self.root = root
+        # list of all <a> elements in document order, which is also
+        # the order in which the browser lists them:
+        self.anchors = list(root.iter('a'))
+        for i,a in enumerate(self.anchors):
+            a.index = i
+
+def from_browser(browser):
+    """return DomSnapshot of page currently loaded in selenium <browser>"""
+    return DomSnapshot(_build(browser.execute_script(SNAPSHOT_JS)))
+
+def anchor_element(browser, i):
+    """return WebElement for the i-th <a> element on the page in <browser>"""
+    return browser.execute_script(ANCHOR_JS, i)
+
+def _build(arr, parent=None):
+    node = DomNode(arr[0], [tuple(a) for a in arr[1]],
+                   height=arr[2], top=arr[3], parent=parent)
+    node.link = arr[4]
+    for c in arr[5:]:
+        node.children.append(c if isinstance(c, str) else _build(c, node))
+    return node
+
+def from_lxml(doc):
+    """return DomSnapshot of lxml html document <doc>"""
+    return DomSnapshot(_build_lxml(doc))
+
+def _build_lxml(el, parent=None):
+    node = DomNode(el.tag.lower(), list(el.items()), parent=parent)
+    if el.text:
+        node.children.append(el.text)
+    for c in el:
+        if isinstance(c.tag, str):
+            node.children.append(_build_lxml(c, node))
+        if c.tail:
+            node.children.append(c.tail)
+    return node
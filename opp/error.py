@@ -44,6 +44,7 @@ message = {
     69: 'pdf conversion failed',
     70: 'parser error',
     71: 'non-UTF8 characters in metadata',
+    72: 'processing budget exceeded',
 
     92: 'database error',
 
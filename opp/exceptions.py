@@ -19,3 +19,9 @@ class UntrainedClassifierException(Exception):
 
 class UnparsableHTMLException(Exception):
     pass
+
+class ExtractorTimeoutException(Exception):
+    pass
+
+class BudgetExceededException(Exception):
+    pass
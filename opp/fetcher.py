@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import asyncio
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from opp.config import config
+from opp.debug import debug
+
+"""
+Download the targets of many links at once.
+
+Fetching the new links on a source page one after the other means
+that we spend most of the time waiting for servers. The Fetcher runs
+the downloads in the background (as tasks in an asyncio loop, each of
+which calls the blocking Link.request in a thread), while the caller
+processes the responses that have already arrived. Requests to the
+same host are limited to a few at a time, with a minimum delay
+between the start of two requests, so that we stay gentle on the
+servers.
+
+Only Link.request runs in the background; everything that touches the
+db happens in the caller's thread.
+"""
+
+# default settings, overridden by config['fetcher']:
+DEFAULTS = {
+    'host_concurrency': 2, # parallel requests per host
+    'host_delay': 1,       # seconds between starting two requests to a host
+    'max_connections': 10, # parallel requests overall
+    'max_pending': 5,      # downloaded responses waiting to be processed
+}
+
+# put on the results queue when the background thread has finished:
+_DONE = object()
+
+class Fetcher():
+
+    def __init__(self, **kwargs):
+        settings = dict(DEFAULTS, **config.get('fetcher', {}))
+        settings.update(kwargs)
+        self.host_concurrency = settings['host_concurrency']
+        self.host_delay = settings['host_delay']
+        self.max_connections = settings['max_connections']
+        # bounded, so that the downloads don't run too far ahead of
+        # the processing:
+        self.results = queue.Queue(maxsize=settings['max_pending'])
+        self._stopped = threading.Event()
+        self._error = None # exception raised in the background thread
+
+    def fetch_all(self, links, only_if_modified=True, download_dir=None):
+        """
+        generator that yields (link, (status, response)) for each of
+        <links>, in the order in which the downloads complete; the
+        (status, response) pair can be passed to Link.fetch. See
+        util.request_url for <download_dir>.
+        """
+        links = list(links)
+        if not links:
+            return
+        self._stopped.clear()
+        self._error = None
+        thread = threading.Thread(target=self._run, args=(links, only_if_modified, download_dir),
+                                  daemon=True)
+        thread.start()
+        try:
+            while True:
+                try:
+                    item = self.results.get(timeout=1)
+                except queue.Empty:
+                    # _run always ends with _DONE, but let's not rely
+                    # on that:
+                    if not thread.is_alive() and self.results.empty():
+                        raise RuntimeError('fetcher thread died')
+                    continue
+                if item is _DONE:
+                    break
+                yield item
+            if self._error:
+                raise self._error
+        finally:
+            # if the caller gave up early, cancel remaining downloads:
+            self._stopped.set()
+            thread.join()
+
+    def _run(self, links, only_if_modified, download_dir):
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self.max_connections)
+        try:
+            loop.run_until_complete(self._fetch_all(loop, executor, links, only_if_modified,
+                                                    download_dir))
+        except Exception as e:
+            # re-raised in fetch_all:
+            debug(1, "error in fetcher: %s", e)
+            self._error = e
+        finally:
+            executor.shutdown(wait=False)
+            loop.close()
+            self._put(_DONE)
+
+    async def _fetch_all(self, loop, executor, links, only_if_modified, download_dir):
+        hosts = {} # hostname => [semaphore, time when next request may start]
+        tasks = []
+        for li in links:
+            host = urlparse(li.url).hostname or ''
+            if host not in hosts:
+                hosts[host] = [asyncio.Semaphore(self.host_concurrency), 0]
+            tasks.append(self._fetch(loop, executor, li, hosts[host], only_if_modified,
+                                     download_dir))
+        await asyncio.gather(*tasks)
+
+    async def _fetch(self, loop, executor, li, host, only_if_modified, download_dir):
+        semaphore = host[0]
+        async with semaphore:
+            now = loop.time()
+            start = max(now, host[1])
+            host[1] = start + self.host_delay
+            if start > now:
+                await asyncio.sleep(start - now)
+            if self._stopped.is_set():
+                return
+            debug(3, "fetching %s", li.url)
+            try:
+                res = await loop.run_in_executor(
+                    executor, functools.partial(li.request, li.url, only_if_modified,
+                                                download_dir=download_dir))
+            except Exception as e:
+                debug(1, "error fetching %s: %s", li.url, e)
+                res = (900, None)
+        await loop.run_in_executor(executor, self._put, (li, res))
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self.results.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
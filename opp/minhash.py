@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import re
+import zlib
+import numpy as np
+from opp import db
+from opp.debug import debug
+
+"""
+Near-duplicate index for documents.
+
+Each document's content is split into shingles (overlapping sequences
+of SHINGLE_WORDS words), and summarized by a MinHash signature:
+for each of NUM_HASHES hash functions, the minimum hash value of all
+shingles. The fraction of positions at which the signatures of two
+documents agree estimates the Jaccard similarity of their shingle
+sets.
+
+Signatures are stored in the docs_minhash table. For fast lookup,
+each signature is also cut into BANDS bands of ROWS values; the hash
+of each band is stored in docs_minhash_bands. Documents that agree on
+at least one whole band are candidates, which are then compared by
+their full signatures. With 64 bands of 2 rows, documents with a
+similarity of 0.3 become candidates with a probability of over 99%,
+unrelated documents (similarity < 0.02) with less than 3%.
+
+The index is maintained by Doc.update_db; documents stored before the
+index existed can be added with bin/build_minhash_index.py.
+"""
+
+SHINGLE_WORDS = 3
+NUM_HASHES = 128
+BANDS = 64
+ROWS = NUM_HASHES // BANDS
+
+# documents with fewer shingles are not indexed:
+MIN_SHINGLES = 20
+
+# hash functions are h(x) = (a*x + b) mod PRIME, for 32-bit shingle
+# hashes x; a and b are fixed so that signatures stay comparable:
+PRIME = 4294967311 # smallest prime > 2**32
+_rand = np.random.RandomState(42)
+_A = _rand.randint(1, 2**31, size=NUM_HASHES).astype(np.uint64)
+_B = _rand.randint(0, 2**31, size=NUM_HASHES).astype(np.uint64)
+
+# number of shingles hashed at once (limits memory use):
+CHUNK = 10000
+
+def shingles(text):
+    """return set of 32-bit hashes of the word shingles in <text>"""
+    words = re.findall(r'\w+', text.lower())
+    res = set()
+    for i in range(len(words) - SHINGLE_WORDS + 1):
+        shingle = ' '.join(words[i:i+SHINGLE_WORDS])
+        res.add(zlib.crc32(shingle.encode('utf-8')))
+    return res
+
+def signature(text):
+    """
+    return MinHash signature of <text> (numpy array of NUM_HASHES
+    uint32 values), or None if <text> is too short
+    """
+    hashes = shingles(text)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    sig = np.full(NUM_HASHES, PRIME, dtype=np.uint64)
+    for i in range(0, len(x), CHUNK):
+        chunk = x[i:i+CHUNK, np.newaxis]
+        # a*x + b stays below 2**64 since a, b < 2**31 and x < 2**32
+        values = (chunk * _A + _B) % PRIME
+        sig = np.minimum(sig, values.min(axis=0))
+    return (sig & 0xffffffff).astype(np.uint32)
+
+def similarity(sig1, sig2):
+    """estimated Jaccard similarity of the documents with signatures <sig1>, <sig2>"""
+    return float(np.count_nonzero(sig1 == sig2)) / NUM_HASHES
+
+def band_keys(sig):
+    """return list of (band, bucket) pairs for signature <sig>"""
+    keys = []
+    for band, row in enumerate(sig.reshape(BANDS, ROWS)):
+        data = row.tobytes()
+        # 63 bits, to fit into a signed BIGINT:
+        keys.append((band, zlib.crc32(data) << 31 ^ zlib.adler32(data)))
+    return keys
+
+def index_doc(doc_id, content):
+    """
+    add document <doc_id> with <content> to the index (or update its
+    entry). Not committed; Doc.update_db commits.
+    """
+    sig = signature(content or '')
+    cur = db.cursor()
+    cur.execute("DELETE FROM docs_minhash_bands WHERE doc_id = %s", (doc_id,))
+    if sig is None:
+        cur.execute("DELETE FROM docs_minhash WHERE doc_id = %s", (doc_id,))
+        return
+    cur.execute("REPLACE INTO docs_minhash (doc_id, signature) VALUES (%s, %s)",
+                (doc_id, sig.tobytes()))
+    cur.executemany("INSERT INTO docs_minhash_bands (band, bucket, doc_id) VALUES (%s, %s, %s)",
+                    [(band, bucket, doc_id) for (band, bucket) in band_keys(sig)])
+    debug(4, "added doc %s to minhash index", doc_id)
+
+def remove_doc(doc_id):
+    cur = db.cursor()
+    cur.execute("DELETE FROM docs_minhash_bands WHERE doc_id = %s", (doc_id,))
+    cur.execute("DELETE FROM docs_minhash WHERE doc_id = %s", (doc_id,))
+
+def similar_docs(content, min_similarity=0.3, exclude_id=None):
+    """
+    return list of (doc_id, similarity) pairs for indexed documents
+    whose estimated similarity to <content> is at least
+    <min_similarity>, most similar first
+    """
+    sig = signature(content or '')
+    if sig is None:
+        return []
+    keys = band_keys(sig)
+    cur = db.cursor()
+    query = "SELECT DISTINCT doc_id FROM docs_minhash_bands WHERE {}".format(
+        " OR ".join(["(band = %s AND bucket = %s)"] * len(keys)))
+    cur.execute(query, [v for key in keys for v in key])
+    if hasattr(cur,"_last_executed"): debug(5, cur._last_executed)
+    ids = [row[0] for row in cur.fetchall() if row[0] != exclude_id]
+    if not ids:
+        return []
+    query = "SELECT doc_id, signature FROM docs_minhash WHERE doc_id IN ({})".format(
+        ",".join(("%s",)*len(ids)))
+    cur.execute(query, ids)
+    res = []
+    for (doc_id, blob) in cur.fetchall():
+        sim = similarity(sig, np.frombuffer(blob, dtype=np.uint32))
+        debug(5, "minhash candidate %s: similarity %s", doc_id, sim)
+        if sim >= min_similarity:
+            res.append((doc_id, sim))
+    return sorted(res, key=lambda x: x[1], reverse=True)
+
+def build_index(batch_size=200):
+    """add all documents that aren't in the index yet"""
+    cur = db.cursor()
+    num = 0
+    last_id = 0
+    while True:
+        query = ("SELECT d.doc_id, d.content FROM docs d"
+                 " LEFT JOIN docs_minhash m ON d.doc_id = m.doc_id"
+                 " WHERE m.doc_id IS NULL AND d.doc_id > %s ORDER BY d.doc_id LIMIT %s")
+        cur.execute(query, (last_id, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        for (doc_id, content) in rows:
+            index_doc(doc_id, content)
+            last_id = doc_id
+            num += 1
+        db.commit()
+        debug(2, "%s documents indexed", num)
+    return num
@@ -1,14 +1,105 @@
 #!/usr/bin/env python3
-import time, re
-from datetime import datetime
+import time, re, math
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from urllib.parse import urlparse
 from opp import db, error, util, philpaperssearch
 from opp.debug import debug, debuglevel
 from opp.webpage import Webpage
+from opp import domsnapshot
+from opp import minhash
 from opp.subjectivebayes import SubjectiveNaiveBayes 
 
-## Finding elements in page
-from selenium.webdriver.common.by import By
+# Writes to the db (update_db, save_to_db, assign_category) are
+# normally committed right away. Inside a unit_of_work() block, they
+# are only committed at the end of the block, in one transaction.
+_uow = threading.local()
+
+@contextmanager
+def unit_of_work():
+    """
+    collect the db writes made in the enclosed block (e.g. for one
+    processed link) in a single transaction, which is committed at the
+    end of the block and rolled back if the block raises an
+    exception. Nested blocks belong to the outermost unit.
+    """
+    depth = getattr(_uow, 'depth', 0)
+    if depth == 0:
+        _uow.written = []
+    _uow.depth = depth + 1
+    try:
+        yield
+        if depth == 0:
+            db.commit()
+    except:
+        if depth == 0:
+            rollback()
+        raise
+    finally:
+        _uow.depth = depth
+
+def commit():
+    """commit, unless we're in a unit_of_work"""
+    if not getattr(_uow, 'depth', 0):
+        db.commit()
+
+def rollback():
+    debug(1, "rolling back %s writes", len(_uow.written))
+    try:
+        db.rollback()
+    except Exception as e:
+        # connection is gone, which also discards the transaction
+        debug(1, "rollback failed: %s", e)
+        db.discard()
+    for (obj, idfield) in _uow.written:
+        # objects inserted in the transaction no longer exist in the db:
+        if idfield:
+            setattr(obj, idfield, 0)
+        # and we no longer know what is stored for the others:
+        obj.__dict__.pop('_db_state', None)
+    _uow.written = []
+
+def written(obj, idfield=None):
+    """
+    remember that <obj> was written to the db (and inserted with new
+    id <idfield>, if given) in the current unit of work
+    """
+    if getattr(_uow, 'depth', 0):
+        _uow.written.append((obj, idfield))
+
+# To avoid redundant writes, Source, Link and Doc objects remember the
+# values of their db fields as last read from or written to the db
+# (in obj._db_state); update_db only writes fields that differ.
+
+def db_value(value):
+    """normalize <value> for comparison with what is stored in the db"""
+    if isinstance(value, datetime):
+        # DATETIME columns have second resolution
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+def mark_clean(obj, fields=None):
+    """
+    record that <fields> (default: all db fields) of <obj> have their
+    current values in the db
+    """
+    if not hasattr(obj, '_db_state') or fields is None:
+        obj._db_state = {}
+    for f in fields if fields is not None else obj.db_fields:
+        obj._db_state[f] = db_value(getattr(obj, f, None))
+
+def dirty_fields(obj, values):
+    """
+    return those of the field => value pairs in dict <values> that
+    differ from the db state of <obj>
+    """
+    state = getattr(obj, '_db_state', None)
+    if state is None:
+        return values
+    return { f: v for f, v in values.items()
+             if f not in state or db_value(v) != state[f] }
 
 class Source(Webpage):
     """ represents a source page with links to papers """
@@ -24,9 +115,23 @@ class Source(Webpage):
         'found_date': None,
         'last_checked': None,
         'default_author': '',
-        'name': '' # e.g. "Australasian Journal of Logic"
+        'name': '', # e.g. "Australasian Journal of Logic"
+        'lease_token': None, # set while a scraper has claimed the source
+        'lease_expires': None,
+        'change_rate': None, # estimated number of changes per day
+        'next_check': None,
+        'js_required': None # page must be loaded in browser? (None = unknown)
     }
 
+    # Revisit schedule: working pages are re-checked at intervals
+    # that depend on how often new links appear on them, broken pages
+    # at a fixed interval.
+    REVISIT_MIN_HOURS = 6
+    REVISIT_MAX_HOURS = 24*14
+    REVISIT_BROKEN_HOURS = 96
+    CHANGE_RATE_PRIOR = 0.2 # assume weekly changes for pages we know nothing about
+    CHANGE_RATE_MEMORY = 30 # days
+
     def __init__(self, **kwargs):
         '''create Source object with attributes given as arguments'''
         super().__init__(kwargs.get('url',''), html=kwargs.get('html',''))
@@ -34,6 +139,8 @@ class Source(Webpage):
             setattr(self, k, kwargs.get(k, v))
         if not self.found_date:
             self.found_date = datetime.now()
+        # when our lease was claimed or last renewed (roughly):
+        self.lease_renewed = time.time()
 
     def load_from_db(self, url=''):
         '''set attributes by looking up this Source in the db'''
@@ -48,20 +155,101 @@ class Source(Webpage):
         if sources:
             for k,v in sources[0].items():
                 setattr(self, k, v)
+            mark_clean(self)
         else:
             debug(4, "%s not in sources table", url)
             
     def update_db(self, **kwargs):
-        """write **kwargs to db, also update 'last_checked'"""
+        """
+        write **kwargs to db, also update 'last_checked' and, if a new
+        status is given, 'next_check'
+        """
         if self.source_id:
-            cur = db.cursor()
             kwargs['last_checked'] = time.strftime('%Y-%m-%d %H:%M:%S') 
-            query = "UPDATE sources SET {},urlhash=MD5(url) WHERE source_id = %s".format(
-                ",".join(k+"=%s" for k in kwargs.keys()))
+            if 'status' in kwargs and 'next_check' not in kwargs:
+                kwargs['next_check'] = self.next_check_date(kwargs['status'])
+            kwargs = dirty_fields(self, kwargs)
+            if not kwargs:
+                return
+            cur = db.cursor()
+            query = "UPDATE sources SET {}{} WHERE source_id = %s".format(
+                ",".join(k+"=%s" for k in kwargs.keys()),
+                ",urlhash=MD5(url)" if 'url' in kwargs else "")
             cur.execute(query, tuple(kwargs.values()) + (self.source_id,))
             if hasattr(cur,"_last_executed"): debug(3, cur._last_executed)
-            db.commit()
+            if hasattr(self, '_db_state'):
+                self._db_state.update((k, db_value(v)) for k,v in kwargs.items())
+                written(self)
+            commit()
     
+    def update_change_rate(self, num_new_links):
+        """
+        update self.change_rate given that <num_new_links> new links
+        have been found since the page was last checked.
+
+        The change rate is an exponentially weighted average of the
+        observed changes per day, where older observations lose
+        weight with a time constant of CHANGE_RATE_MEMORY days. So a
+        page that is checked every 6 hours and gets a new link once a
+        day ends up with a rate of about 1.
+        """
+        if not self.last_checked:
+            # on the first visit, all links are new
+            return self.change_rate
+        hours = (datetime.now() - self.last_checked).total_seconds() / 3600
+        days = max(hours, 1) / 24
+        observed = (1 if num_new_links else 0) / days
+        rate = self.CHANGE_RATE_PRIOR if self.change_rate is None else self.change_rate
+        weight = 1 - math.exp(-days / self.CHANGE_RATE_MEMORY)
+        self.change_rate = (1-weight) * rate + weight * observed
+        debug(2, "change rate of %s: %.3f/day", self.url, self.change_rate)
+        return self.change_rate
+
+    def revisit_hours(self, status=None):
+        """return number of hours after which the page should be checked again"""
+        status = self.status if status is None else status
+        if status > 1:
+            return self.REVISIT_BROKEN_HOURS
+        rate = self.CHANGE_RATE_PRIOR if self.change_rate is None else self.change_rate
+        if rate <= 0:
+            return self.REVISIT_MAX_HOURS
+        # check again after half the expected time until the next change:
+        hours = 12 / rate
+        return min(max(hours, self.REVISIT_MIN_HOURS), self.REVISIT_MAX_HOURS)
+
+    def next_check_date(self, status=None):
+        """return date at which the page should be checked again"""
+        next_check = datetime.now() + timedelta(hours=self.revisit_hours(status))
+        return next_check.strftime('%Y-%m-%d %H:%M:%S')
+
+    def renew_lease(self, lease_secs, min_interval=0):
+        """
+        extend our lease on this source to <lease_secs> from now,
+        unless it has been claimed or renewed less than <min_interval>
+        seconds ago
+        """
+        if time.time() - self.lease_renewed < min_interval:
+            return
+        if self.source_id and self.lease_token:
+            cur = db.cursor()
+            query = ("UPDATE sources SET lease_expires = NOW() + INTERVAL %s SECOND"
+                     " WHERE source_id = %s AND lease_token = %s")
+            cur.execute(query, (lease_secs, self.source_id, self.lease_token))
+            if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
+            db.commit()
+        self.lease_renewed = time.time()
+
+    def release_lease(self):
+        """allow other scrapers to claim this source again"""
+        if self.source_id and self.lease_token:
+            cur = db.cursor()
+            query = ("UPDATE sources SET lease_token = NULL, lease_expires = NULL"
+                     " WHERE source_id = %s AND lease_token = %s")
+            cur.execute(query, (self.source_id, self.lease_token))
+            if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
+            db.commit()
+            self.lease_token = None
+
     def mark_as_dead(self, statuscode):
         """write <statuscode> to db or delete page if previously has same status"""
         if not self.source_id:
@@ -88,45 +276,47 @@ class Source(Webpage):
             ",".join(fields), ",".join(("%s",)*len(fields)))
         cur.execute(query, values)
         if hasattr(cur,"_last_executed"): debug(3, cur._last_executed)
-        db.commit()
         self.source_id = cur.lastrowid
+        written(self, 'source_id')
+        mark_clean(self, fields)
+        commit()
     
     def set_html(self, html):
         debug(6, "\n====== %s ======\n%s\n======\n", self.url, html)
         self.html = html
+        # reset cached representations:
+        self._lxmldoc = None
+        self._text = None
+        self._base_href = None
+        self._session_vars = None
+        self._links_by_session_free_url = None
+        if hasattr(self, '_svarpat'):
+            del self._svarpat
 
-    def extract_links(self, browser):
+    def extract_links(self, browser=None):
         """
         extracts links from source page; sets self.new_links and
         self.old_links, both lists of Link objects. An "old link" is a
         link currently on the page that's already in the database. A
         "new link" is not yet in the database.
+
+        If <browser> is None, links are extracted from self.html.
         """
         self.new_links = []
         self.old_links = []
         new_links = {} # url => Link
         old_links = {} # url => Link
         
-        # lots of try/except because selenium easily crashes:
+        self.browser = browser
         try:
-            
-            ## Selenium introduced breaking changes
-            # els = browser.find_elements_by_tag_name("a")
-            els = browser.find_elements(By.TAG_NAME,"a")
-            
-        except:
-            debug(1, "cannot retrieve links from page %s", self.url)
-            return [],[]
-        for el in els:
-            try:
-                if not el.is_displayed():
-                    continue
-                href = el.get_attribute('href')
-                anchortext = el.text
-                if not href:
-                    continue
-            except:
-                continue
+            if browser:
+                self.dom = domsnapshot.from_browser(browser)
+            else:
+                self.dom = domsnapshot.from_lxml(self.lxmldoc())
+        except Exception as e:
+            debug(1, "cannot retrieve links from page %s: %s", self.url, e)
+            return
+        for (node, href, anchortext) in self.anchors():
             if self.link_has_bad_url(href):
                 debug(4, 'ignoring link to %s (bad url)', href)
                 continue
@@ -136,13 +326,40 @@ class Source(Webpage):
             if old_link:
                 debug(3, 'link to %s is old', href)
                 old_links[href] = old_link
-                old_links[href].element = el
+                old_links[href].node = node
             else:
                 debug(1, 'new link: "%s" %s', anchortext, href)
-                new_links[href] = Link(url=href, source=self, element=el)
+                new_links[href] = Link(url=href, source=self, node=node)
 
         self.new_links = new_links.values()
         self.old_links = old_links.values()
+
+    def anchors(self):
+        """
+        return list of (node, href, anchortext) for visible links in
+        self.dom
+        """
+        anchors = []
+        for node in self.dom.anchors:
+            if node.link: # from browser, which has resolved the href
+                if not node.link['visible']:
+                    continue
+                href = node.link['href'] or ''
+                anchortext = node.link['text']
+            else:
+                if node.is_hidden():
+                    continue
+                href = (node.get('href') or '').strip()
+                if href and not href.startswith(('javascript:', 'mailto:')):
+                    href = self.make_absolute(href)
+                anchortext = node.text().strip()
+            if not href or href.startswith(('javascript:', 'mailto:')):
+                continue
+            # the same link must get the same url whether the page was
+            # loaded in the browser or not, so that it is recognized
+            # as old:
+            anchors.append((node, util.normalize_url(href), anchortext))
+        return anchors
  
     def link_has_bad_url(self, url):
         """
@@ -172,6 +389,14 @@ class Source(Webpage):
         except Exception as e:
             return True
 
+    @staticmethod
+    def url_variant_key(url):
+        """
+        return <url> without scheme, 'www.' and trailing slashes, so
+        that trivial variants of a url have the same key
+        """
+        return url.split('//', 1)[-1].replace('www.', '').rstrip('/')
+
     def old_link(self, url):
         """
         If a link to (a trivial variant of) <url> is already known on this
@@ -184,28 +409,39 @@ class Source(Webpage):
             cur.execute(query, (self.source_id,))
             if hasattr(cur,"_last_executed"): debug(5, cur._last_executed)
             self._links = [ Link(source=self, **li) for li in cur.fetchall() ]
-            #debug(2, 'xxx old links:\n%s', '\n'.join([li.url for li in self._links]))
+            for li in self._links:
+                mark_clean(li)
+            # index the links by url and by url variant key:
+            self._links_by_url = {}
+            self._links_by_variant = {}
+            for li in self._links:
+                self._links_by_url.setdefault(li.url, li)
+                self._links_by_variant.setdefault(self.url_variant_key(li.url), li)
 
-        for li in self._links:
-            if li.url == url:
-                return li
+        li = self._links_by_url.get(url)
+        if li:
+            return li
 
         # ignore https vs http, www vs non-www and trailing slashes:
-        urlfrag = url.split('//', 2)[1].replace('www.', '').rstrip('/')
-        #debug(2, 'xxx urlfrag {}'.format(urlfrag))
-        for li in self._links:
-            #debug(2, 'xxx urlfrag li {}'.format(li.url.split('//', 2)[1].replace('www.', '').rstrip('/')))
-            if li.url.split('//', 2)[1].replace('www.', '').rstrip('/') == urlfrag:
-                debug(2, '{} is trivial variant of {}; updating url in db'.format(url, li.url))
-                li.update_db(url=url)
-                return li
+        li = self._links_by_variant.get(self.url_variant_key(url))
+        if li:
+            debug(2, '{} is trivial variant of {}; updating url in db'.format(url, li.url))
+            self._links_by_url.pop(li.url, None)
+            li.update_db(url=url)
+            self._links_by_url[url] = li
+            return li
 
         # ignore session variants:
         s_url = self.strip_session_variables(url)
         if s_url != url:
-            for li in self._links:
-                if s_url == self.strip_session_variables(li.url):
-                    return li
+            # the session variables depend on the current page, so
+            # this index is reset in set_html:
+            if getattr(self, '_links_by_session_free_url', None) is None:
+                self._links_by_session_free_url = {}
+                for li in self._links:
+                    self._links_by_session_free_url.setdefault(
+                        self.strip_session_variables(li.url), li)
+            return self._links_by_session_free_url.get(s_url)
 
         return None
 
@@ -421,7 +657,7 @@ class Source(Webpage):
             query = "INSERT INTO publications (author, title, year) VALUES (%s,%s,%s)"
             cur.execute(query, (name, pub[0], pub[1]))
             if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
-        db.commit()
+        commit()
         return [pub[0] for pub in pubs]
 
     def get_duplicates(self):
@@ -471,10 +707,26 @@ class Link():
         if not self.found_date:
             self.found_date = datetime.now()
         self.source = kwargs.get('source')
-        self.element = kwargs.get('element') # the dom element from Browser
+        self.node = kwargs.get('node') # the element in the page's DomSnapshot
+        self._element = kwargs.get('element')
         if self.source:
             self.source_id = self.source.source_id
     
+    @property
+    def element(self):
+        """
+        the link's WebElement in the browser; looked up only when
+        needed, since the DomSnapshot (self.node) usually suffices
+        """
+        browser = getattr(self.source, 'browser', None)
+        if self._element is None and self.node and browser:
+            self._element = domsnapshot.anchor_element(browser, self.node.index)
+        return self._element
+
+    @element.setter
+    def element(self, el):
+        self._element = el
+
     def html_context(self):
         """
         sets self.anchortext and self.context, where the latter is the
@@ -500,6 +752,10 @@ class Link():
             <a>PDF</a>", or "<h4><a>Paper1</a></h4> Forthcoming
             <h4><a>Paper2</a></h4>".
 
+        The DOM is not queried through the browser, but through a
+        snapshot of the page (see opp.domsnapshot), in which the link
+        is self.node.
+
         To tell these apart, we first climb up the DOM tree until we
         reach an element that's too large to be a single paper entry
         (careful of abstracts here). If the element right below (call
@@ -514,38 +770,27 @@ class Link():
         """
 
         debug(4, 'trying to find link context')
-        try:
-            self.anchortext = self.element.get_attribute('textContent').strip()
-        except Exception as e:
-            debug(1, "cannot retrieve link context: %s", str(e))
+        if not self.node:
+            debug(1, "cannot retrieve link context: link not in DOM snapshot")
             self.context = ''
             self.anchortext = ''
             return ''
+        self.anchortext = self.node.text().strip()
 
         # First climb up DOM until we reach an element (par) that's
         # too large:
-        el = self.element
-        
-        ## Selenium introduced breaking changes
-        # par = el.find_element_by_xpath('..')
-        par = el.find_element("xpath",'..')
-        
-        debug(4, 'starting with %s', el.get_attribute('outerHTML'))
-        el._text = el.get_attribute('textContent')
-        while (True):
-            debug(4, 'climbing up par: %s', par.get_attribute('outerHTML'))
+        el = self.node
+        par = el.parent
+        debug(4, 'starting with %s', el.outer_html())
+        while par:
+            debug(4, 'climbing up par: %s', par.outer_html())
             
             # check if parent has many links or other significant children
-            ## Selenium introduced breaking changes
-            par._links = par.find_elements('xpath','.//a')
-            par._children = par.find_elements('xpath','./*')
-            # par._links = par.find_elements_by_xpath('.//a')
-            # par._children = par.find_elements_by_xpath('./*')
-            
-            if len(par._links) > 3:
-                debug(4, 'stopping: too many links (%s)', len(par._links))
+            num_links = sum(1 for a in par.iter('a'))
+            if num_links > 3:
+                debug(4, 'stopping: too many links (%s)', num_links)
                 break
-            sc = [c for c in par._children if len(c.get_attribute('textContent')) > 10]
+            sc = [c for c in par.elements if len(c.text()) > 10]
             if len(sc) > 5:
                 debug(4, 'stopping: too many children (%s)', len(sc))
                 break
@@ -555,115 +800,98 @@ class Link():
             # if the entries are very short, but then that's not a
             # serious problem because we won't be misled by
             # publication info that belongs to another entry.)
-            par._text = par.get_attribute('textContent')
-            if len(el._text) > 70 and len(par._text) > len(el._text)*1.5:
-                debug(4, 'stopping: enough text already (%s)', el._text)
+            if len(el.text()) > 70 and len(par.text()) > len(el.text())*1.5:
+                debug(4, 'stopping: enough text already (%s)', el.text())
                 break
-            try:
-                
-                ## Selenium introduced breaking changes
-                gpar = par.find_element('xpath','..')
-                # gpar = par.find_element_by_xpath('..')
-                
-                el,par = par,gpar
-            except Exception:
+            if not par.parent:
                 break
+            el,par = par,par.parent
+        if not par:
+            # link is the root element?!
+            self.context = el.text().strip()
+            return self.context
         
         # If el has no further text than the link with which we
         # started but there's neighbouring text not in a link, we're
         # in the messy case (3):
-        if len(el._text) - len(self.element._text) < 5:
-            par._outerHTML = par.get_attribute('outerHTML')
-            el._outerHTML = el.get_attribute('outerHTML')
+        if len(el.text()) - len(self.node.text()) < 5:
             try:
-                l,r = par._outerHTML.split(el._outerHTML, 1)
+                l,r = par.outer_html().split(el.outer_html(), 1)
             except ValueError: # no split, what now?
-                return el._text
+                return el.text()
             if re.search(r'\w\s*$', l) or re.search(r'^\s*\w', r):
                 debug(4, 'argh: case (3)')
                 for pat in (r'<h\d.*?>', r'<br>\s*<br>', r'<br>'):
-                    parts = re.split(pat, par._outerHTML, flags=re.I)
+                    parts = re.split(pat, par.outer_html(), flags=re.I)
                     if len(parts) > 1:
                         break
                 for part in parts:
-                    if el._outerHTML in part:
+                    if el.outer_html() in part:
                         debug(5, 'surrounding part: %s', part)
                         return util.strip_tags(part)
                 # we should never be here
-                return el._text
+                return el.text()
         
         # Now try to figure out if siblings belong to context:
+        siblings = par.elements
+        pos = siblings.index(el)
+
         def context_left(i):
-            if par._children.index(el)-i < 0:
+            if pos-i < 0:
                 # can't catch IndexError: careful of negative indices!
                 return ''
-            lsib = par._children[par._children.index(el)-i]
-            lsib_outerHTML = lsib.get_attribute('outerHTML')
-            debug(4, "add left sibling?: %s", lsib_outerHTML)
-            if re.search(r'\.(?:pdf|docx?)\b', lsib_outerHTML, flags=re.I):
+            lsib = siblings[pos-i]
+            debug(4, "add left sibling?: %s", lsib.outer_html())
+            if re.search(r'\.(?:pdf|docx?)\b', lsib.outer_html(), flags=re.I):
                 debug(4, "no: contains link to pdf or doc")
                 return ''
-            lsib_height = lsib.get_attribute('offsetHeight')
-            lsib_height = int(lsib_height) if lsib_height else 0
-            lsib_text = lsib.get_attribute('textContent')
-            if lsib_text.strip() == '' and lsib_height > 2:
+            if lsib.text().strip() == '' and lsib.height > 2:
                 debug(4, "no: sibling has no text but takes up space")
                 return ''
-            lsib_bottom = lsib.location['y'] + lsib_height
-            gap = par._children[par._children.index(el)-(i-1)].location['y'] - lsib_bottom
+            gap = siblings[pos-(i-1)].top - (lsib.top + lsib.height)
             if gap > 20 or (gap > 10 and len(context) > 20):
                 debug(4, "no: too far away (%s)", gap)
                 return ''
             debug(4, "yes, expanding context")
-            return lsib_text
+            return lsib.text()
 
         def context_right(i):
             try:
-                rsib = par._children[par._children.index(el)+i]
+                rsib = siblings[pos+i]
             except IndexError:
                 return ''
-            rsib_outerHTML = rsib.get_attribute('outerHTML')
-            debug(4, "add right sibling?: %s", rsib_outerHTML)
-            if re.search(r'\.(?:pdf|docx?)\b', rsib_outerHTML, flags=re.I):
+            debug(4, "add right sibling?: %s", rsib.outer_html())
+            if re.search(r'\.(?:pdf|docx?)\b', rsib.outer_html(), flags=re.I):
                 debug(4, "no: contains link to pdf or doc")
                 return ''
             if (len(context) > 20 
-                and not re.search(r'\d{4}|draft|forthcoming', rsib_outerHTML, flags=re.I)):
+                and not re.search(r'\d{4}|draft|forthcoming', rsib.outer_html(), flags=re.I)):
                 # We're mainly interested in author, title,
                 # publication info. The first two never occur after
                 # the link element (unless that is very short: e.g. an
                 # icon), so we only need to check for the third.
                 debug(4, "no: doesn't look like publication info")
                 return ''
-            rsib_height = int(rsib.get_attribute('offsetHeight'))
-            rsib_text = rsib.get_attribute('textContent')
-            if rsib_text.strip() == '' and rsib_height > 2:
+            if rsib.text().strip() == '' and rsib.height > 2:
                 debug(4, "no: sibling has no text but takes up space")
                 return ''
-            rsiblsib = par._children[par._children.index(el)+(i-1)]
-            rsiblsib_bottom = rsiblsib.location['y'] + int(rsiblsib.get_attribute('offsetHeight'))
-            gap = rsib.location['y'] - rsiblsib_bottom
+            rsiblsib = siblings[pos+(i-1)]
+            gap = rsib.top - (rsiblsib.top + rsiblsib.height)
             if gap > 20 or (gap > 10 and len(context) > 20):
                 debug(4, "no: too far away (%s)", gap)
                 return ''
             debug(4, "yes, expanding context")
-            return rsib_text
+            return rsib.text()
 
-        context = el.get_attribute('textContent')
+        context = el.text()
         debug(4, "initial context: %s", context)
         for i in (1,2,3):
-            try:
-                more = context_right(i)
-            except:
-                break
+            more = context_right(i)
             if not more:
                 break
             context += '\n' + more
         for i in (1,2,3,4):
-            try:
-                more = context_left(i)
-            except:
-                break
+            more = context_left(i)
             if not more:
                 break
             context = more + '\n' + context
@@ -685,6 +913,7 @@ class Link():
         if links:
             for k,v in links[0].items():
                 setattr(self, k, v)
+            mark_clean(self)
         else:
             debug(4, "link to %s not in database", url)
     
@@ -695,15 +924,22 @@ class Link():
         """
         for k,v in kwargs.items():
             setattr(self, k, v)
-        cur = db.cursor()
         self.last_checked = datetime.now()
         fields = [f for f in self.db_fields.keys()
                   if f != 'link_id' and getattr(self, f) is not None]
+        if self.link_id:
+            fields = list(dirty_fields(self, { f: getattr(self, f) for f in fields }))
+            if not fields:
+                debug(5, "link %s unchanged", self.link_id)
+                return
         values = [getattr(self, f) for f in fields]
+        cur = db.cursor()
         if self.link_id:
-            query = "UPDATE links SET {},urlhash=MD5(url) WHERE link_id = %s".format(
-                ",".join(k+"=%s" for k in fields))
+            query = "UPDATE links SET {}{} WHERE link_id = %s".format(
+                ",".join(k+"=%s" for k in fields),
+                ",urlhash=MD5(url)" if 'url' in fields else "")
             cur.execute(query, values + [self.link_id])
+            written(self)
         else:
             query = "INSERT INTO links ({},urlhash) VALUES ({},MD5(url))".format(
                 ",".join(fields), ",".join(("%s",)*len(fields)))
@@ -713,34 +949,107 @@ class Link():
                 debug(1, "oops, %s: %s", query, ','.join(map(str, values)))
                 # raise
             self.link_id = cur.lastrowid
+            if self.link_id:
+                written(self, 'link_id')
         
         ## SFM I don't know what this is doing so I don't know how to fix it properly.
         if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
         
-        db.commit()
+        if self.link_id:
+            mark_clean(self, fields)
+        commit()
+
+    # number of rows per statement in save_all:
+    BULK_ROWS = 500
+
+    @staticmethod
+    def save_all(links, **kwargs):
+        """
+        set **kwargs on all <links> and write them to the db in bulk:
+        links that are already in the db (same source and url) are
+        updated, the others inserted. Afterwards each link's link_id
+        is set. As in update_db, None values don't overwrite what's in
+        the db, and 'last_checked' is set.
+        """
+        links = list(links)
+        if not links:
+            return
+        now = datetime.now()
+        for li in links:
+            for k,v in kwargs.items():
+                setattr(li, k, v)
+            li.last_checked = now
+        fields = [f for f in Link.db_fields.keys() if f != 'link_id']
+        # all placeholders must be plain %s so that executemany can
+        # turn this into multi-row inserts:
+        query = ("INSERT INTO links ({},urlhash) VALUES ({},%s)"
+                 " ON DUPLICATE KEY UPDATE {}").format(
+                     ",".join(fields), ",".join(("%s",)*len(fields)),
+                     ",".join("{0}=COALESCE(VALUES({0}),{0})".format(f) for f in fields
+                              if f not in ('url', 'source_id', 'found_date')))
+        cur = db.cursor()
+        for i in range(0, len(links), Link.BULK_ROWS):
+            rows = [[getattr(li, f) for f in fields] + [Link.urlhash(li.url)]
+                    for li in links[i:i+Link.BULK_ROWS]]
+            cur.executemany(query, rows)
+            if hasattr(cur,"_last_executed"): debug(5, cur._last_executed)
+        # look up the ids of the inserted rows:
+        ids = {}
+        by_source = {}
+        for li in links:
+            by_source.setdefault(li.source_id, []).append(Link.urlhash(li.url))
+        for source_id, hashes in by_source.items():
+            for i in range(0, len(hashes), Link.BULK_ROWS):
+                chunk = hashes[i:i+Link.BULK_ROWS]
+                query = "SELECT link_id, urlhash FROM links WHERE source_id = %s AND urlhash IN ({})".format(
+                    ",".join(("%s",)*len(chunk)))
+                cur.execute(query, [source_id] + chunk)
+                for (link_id, urlhash) in cur.fetchall():
+                    ids[(source_id, urlhash)] = link_id
+        for li in links:
+            link_id = ids.get((li.source_id, Link.urlhash(li.url)))
+            if not link_id:
+                debug(1, "oops, link to %s not saved", li.url)
+                continue
+            if not li.link_id:
+                li.link_id = link_id
+                written(li, 'link_id')
+            else:
+                written(li)
+            mark_clean(li, [f for f in fields if getattr(li, f) is not None])
+        debug(3, "saved %s links", len(links))
+        commit()
+
+    @staticmethod
+    def urlhash(url):
+        """same as MD5(url) in mysql"""
+        return hashlib.md5(url.encode('utf-8')).hexdigest()
 
-    def fetch(self, url=None, only_if_modified=True):
+    def fetch(self, url=None, only_if_modified=True, response=None, download_dir=None):
         '''
         fetch linked address (or <url>), returns response object on
-        success, otherwise stores error in db and returns None.
+        success, otherwise stores error in db and returns None. If the
+        address has already been downloaded (e.g. by opp.fetcher),
+        <response> is the (status, response) pair from self.request.
+        See util.request_url for <download_dir>.
         '''
-        time.sleep(1) # be gentle on servers
         url = url or self.url
+        if response:
+            status,r = response
+        else:
+            time.sleep(1) # be gentle on servers
+            status,r = self.request(url, only_if_modified, download_dir=download_dir)
         if only_if_modified and self.last_checked:
-            ims = self.last_checked.strftime('%a, %d %b %Y %H:%M:%S GMT')
-            status,r = util.request_url(url, if_modified_since=ims, etag=self.etag, timeout=15)
             if (status == 304 or
                 status == 200 and r.headers.get('content-length') == self.filesize):
                 self.update_db()
                 debug(1, "not modified")
                 return None
-        else:
-            status,r = util.request_url(url)
         if status != 200:
             self.update_db(status=status)
             debug(1, "error status %s", status)
             return None
-        if not r.text:
+        if not r.size:
             self.update_db(status=error.code['document is empty'])
             debug(1, 'document is empty')
             return None
@@ -748,6 +1057,18 @@ class Link():
         self.filesize = r.headers.get('content-length')
         return r
 
+    def request(self, url=None, only_if_modified=True, download_dir=None):
+        '''
+        download linked address (or <url>), returns (status, response);
+        doesn't touch the db, so this can run in a separate thread
+        '''
+        url = url or self.url
+        if only_if_modified and self.last_checked:
+            ims = self.last_checked.strftime('%a, %d %b %Y %H:%M:%S GMT')
+            return util.request_url(url, if_modified_since=ims, etag=self.etag, timeout=15,
+                                    download_dir=download_dir)
+        return util.request_url(url, download_dir=download_dir)
+
 class Doc():
     """ represents a paper """
 
@@ -834,6 +1155,7 @@ class Doc():
         if docs:
             for k,v in docs[0].items():
                 setattr(self, k, v)
+            mark_clean(self)
             return True
         else:
             debug(4, "no doc with id %s or url %s in database", doc_id, url)
@@ -843,21 +1165,34 @@ class Doc():
         """update self.**kwargs and write present state to db"""
         for k, v in kwargs.items():
             setattr(self, k, v)
-        cur = db.cursor()
         fields = [f for f in self.db_fields.keys()
                   if f != 'doc_id' and getattr(self, f) is not None]
+        if self.doc_id:
+            # only write what has changed; in particular, don't resend
+            # the content if it hasn't changed:
+            fields = list(dirty_fields(self, { f: getattr(self, f) for f in fields }))
+            if not fields:
+                debug(5, "doc %s unchanged", self.doc_id)
+                return
         values = [getattr(self, f) for f in fields]
+        cur = db.cursor()
         if self.doc_id:
-            query = "UPDATE docs SET {},urlhash=MD5(url) WHERE doc_id = %s".format(
-                ",".join(k+"=%s" for k in fields))
+            query = "UPDATE docs SET {}{} WHERE doc_id = %s".format(
+                ",".join(k+"=%s" for k in fields),
+                ",urlhash=MD5(url)" if 'url' in fields else "")
             cur.execute(query, values + [self.doc_id])
+            written(self)
         else:
             query = "INSERT INTO docs ({},urlhash) VALUES ({},MD5(url))".format(
                 ",".join(fields), ",".join(("%s",)*len(fields)))
             cur.execute(query, values)
             self.doc_id = cur.lastrowid
+            written(self, 'doc_id')
         if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
-        db.commit()
+        if 'content' in fields:
+            minhash.index_doc(self.doc_id, self.content)
+        mark_clean(self, fields)
+        commit()
         
     def assign_category(self, cat_id, strength):
         """inserts or updates a docs2cats entry in the db"""
@@ -868,7 +1203,7 @@ class Doc():
                  " ON DUPLICATE KEY UPDATE strength=%s")
         cur.execute(query, (cat_id, self.doc_id, strength, strength))
         if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
-        db.commit()
+        commit()
 
     @property
     def default_author(self):
@@ -27,6 +27,7 @@ fixes a few characters and words.
 
 Can be called from the command-line, or included as a module.
 Command-line usage: $0 [-hv] <xmlfile>
+With <xmlfile> '-', reads from STDIN and writes to STDOUT.
 
 -v        : verbose
 -h        : this message
@@ -51,20 +52,26 @@ sub verbose {
 }
 
 sub doctidy {
+    # $file '-' means: read from STDIN, write to STDOUT
     my $file = shift;
-    print "\n\nDOCTIDY: $file\n" if $verbose;
-    
-    open IN, $file or die $!;
-    open OUT, ">$file.tidy" or die $!;
-    binmode(OUT, ":utf8");
+    my ($in, $out);
+    if ($file eq '-') {
+        ($in, $out) = (\*STDIN, \*STDOUT);
+    }
+    else {
+        print "\n\nDOCTIDY: $file\n" if $verbose;
+        open $in, $file or die $!;
+        open $out, ">$file.tidy" or die $!;
+        binmode($out, ":utf8");
+    }
 
     my $inpage = 0;
     my $page = '';
-    while (<IN>) {
+    while (<$in>) {
         $_ = Encode::decode_utf8($_);
         if ($inpage) {
             if (/<\/page>/) {
-                print OUT pagetidy($page);
+                print $out pagetidy($page);
                 $inpage = 0;
             }
             else {
@@ -76,13 +83,14 @@ sub doctidy {
             $inpage = 1;
             $page = '';
         }
-        print OUT $_;
+        print $out $_;
     }
 
-    close IN;
-    close OUT;
-
-    rename "$file.tidy", $file;
+    unless ($file eq '-') {
+        close $in;
+        close $out;
+        rename "$file.tidy", $file;
+    }
 }
 
 sub pagetidy {
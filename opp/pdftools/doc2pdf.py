@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import os
+import time
+import queue
+import shutil
+import signal
+import socket
+import atexit
+import tempfile
+import threading
+import subprocess
+from opp.config import config
+from opp.debug import debug
+from opp import budget
+
+"""
+Convert .doc/.docx/.rtf etc. files to pdf with a pool of resident
+LibreOffice processes.
+
+Calling unoconv on its own starts a fresh LibreOffice instance for
+every file, which takes several seconds. Instead, we keep a few
+headless soffice listeners running (each with its own user profile
+and port, so that they can work in parallel) and tell unoconv to
+connect to one of them. Listeners are checked before use, and
+restarted when they have died, when a conversion fails or times out,
+or after a number of conversions.
+
+Every process has its own pool. A scraper process converts one
+document at a time, so one listener is enough there; more only help
+if a process converts documents from several threads.
+
+Settings are read from config['doc2pdf'].
+"""
+
+SOFFICE = '/usr/bin/soffice'
+UNOCONV = ['/usr/bin/python3', '/usr/bin/unoconv']
+
+DEFAULTS = {
+    'listeners': 1,           # number of soffice processes (per scraper process)
+    'timeout': 20,            # seconds per conversion
+    'max_conversions': 100,   # restart listener after this many conversions
+    'start_timeout': 30,      # seconds to wait for a listener to come up
+}
+
+class Listener():
+    """a headless soffice process accepting uno connections"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.process = None
+        self.port = None
+        self.profile = None
+        self.conversions = 0
+
+    def start(self):
+        self.port = free_port()
+        self.profile = tempfile.mkdtemp(prefix='opp-soffice-')
+        cmd = [SOFFICE, '--headless', '--invisible', '--nologo',
+               '--norestore', '--nodefault',
+               '-env:UserInstallation=file://{}'.format(self.profile),
+               '--accept=socket,host=127.0.0.1,port={};urp;StarOffice.ComponentContext'.format(self.port)]
+        debug(2, ' '.join(cmd))
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL,
+                                        start_new_session=True)
+        self.conversions = 0
+        deadline = time.time() + self.settings['start_timeout']
+        while not self.is_alive():
+            if self.process.poll() is not None or time.time() > deadline:
+                self.stop()
+                raise Exception('cannot start soffice listener')
+            time.sleep(0.2)
+        debug(2, "soffice listener %s running on port %s", self.process.pid, self.port)
+
+    def is_alive(self):
+        if not self.process or self.process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def stop(self):
+        if self.process:
+            debug(2, "stopping soffice listener %s", self.process.pid)
+            # soffice runs soffice.bin in a child process that can
+            # outlive it, so we signal the whole process group:
+            self.killpg(signal.SIGTERM)
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                self.process.poll() # reap the wrapper once it exits
+                if not self.killpg(0):
+                    break
+                time.sleep(0.1)
+            self.killpg(signal.SIGKILL)
+            self.process.wait()
+        self.process = None
+        if self.profile:
+            shutil.rmtree(self.profile, ignore_errors=True)
+            self.profile = None
+
+    def killpg(self, sig):
+        """
+        send <sig> to the listener's process group; returns False if
+        the group is gone
+        """
+        try:
+            os.killpg(self.process.pid, sig)
+            return True
+        except OSError:
+            return False
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def convert(self, infile, outfile):
+        if (not self.is_alive()
+            or self.conversions >= self.settings['max_conversions']):
+            self.restart()
+        cmd = UNOCONV + ['--no-launch', '--port', str(self.port),
+                         '-f', 'pdf', '-o', outfile, infile]
+        debug(2, ' '.join(cmd))
+        self.conversions += 1
+        try:
+            budget.run(cmd, timeout=self.settings['timeout'], stdout=None, stderr=None,
+                       check=True)
+        except Exception:
+            # the listener may be hanging on the file:
+            self.stop()
+            raise
+
+class ListenerPool():
+
+    def __init__(self, **kwargs):
+        self.settings = dict(DEFAULTS, **config.get('doc2pdf', {}))
+        self.settings.update(kwargs)
+        self.listeners = []
+        self.idle = queue.Queue()
+        for i in range(self.settings['listeners']):
+            listener = Listener(self.settings)
+            self.listeners.append(listener)
+            self.idle.put(listener)
+
+    def convert(self, infile, outfile):
+        """convert <infile> to pdf <outfile>, waiting for a free listener"""
+        listener = self.idle.get()
+        try:
+            listener.convert(infile, outfile)
+        finally:
+            self.idle.put(listener)
+        if not os.path.exists(outfile):
+            raise Exception('unoconv produced no output')
+        return outfile
+
+    def close(self):
+        for listener in self.listeners:
+            listener.stop()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def pool():
+    """return the listener pool of this process (started on first use)"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ListenerPool()
+            _pool_pid = os.getpid()
+        return _pool
+
+def doc2pdf(infile, outfile):
+    """convert <infile> to pdf <outfile>"""
+    return pool().convert(infile, outfile)
+
+def stop_listeners():
+    global _pool
+    with _pool_lock:
+        # don't touch listeners inherited from the parent process:
+        if _pool and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+atexit.register(stop_listeners)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
@@ -2,6 +2,7 @@
 from os.path import abspath, dirname, join
 import subprocess
 from debug import debug, debuglevel
+from opp import budget
 
 PERL = '/usr/bin/perl'
 PATH = abspath(dirname(__file__))
@@ -18,3 +19,14 @@ def doctidy(xmlfile):
         raise
     if debuglevel() > 4:
         debug(5, stdout.decode('utf-8'))
+
+def doctidy_xml(xml):
+    """tidy xml string <xml>, returns tidied string"""
+    cmd = [PERL, join(PATH, 'Doctidy.pm'), '-']
+    debug(2, ' '.join(cmd))
+    try:
+        proc = budget.run(cmd, input=xml.encode('utf-8'), timeout=10, check=True)
+    except subprocess.CalledProcessError as e:
+        debug(1, e.stderr)
+        raise
+    return proc.stdout.decode('utf-8')
@@ -1,11 +1,9 @@
 #!/usr/bin/env python3
 import re
 import os
-from os.path import join, basename
 import sys
-import tempfile
-import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 from statistics import median, stdev
 import lxml.html
@@ -16,85 +14,108 @@ curpath = os.path.abspath(os.path.dirname(__file__))
 libpath = os.path.join(curpath, os.path.pardir)
 sys.path.insert(0, libpath)
 from opp.debug import debug, debuglevel
+from opp.config import config
+from opp import budget
 from .pdftools import pdfinfo
-from .doctidy import doctidy
+from .doctidy import doctidy_xml
 from opp.exceptions import *
 
-PDFSEPARATE = '/usr/bin/pdfseparate'
 PDFTOPPM = '/usr/bin/pdftoppm'
 # TESSERACT = '/usr/local/bin/tesseract'    # SFM
 TESSERACT = '/usr/bin/tesseract'            # SFM
 
 OCR_DPI = 300
 
-def tempdir():
-    if not hasattr(tempdir, 'dirname'):
-        tempdir.dirname = tempfile.mkdtemp()
-        debug(2, "creating temporary directory: %s", tempdir.dirname)
-    return tempdir.dirname
-
-def remove_tempdir():
-    if hasattr(tempdir, 'dirname'):
-        shutil.rmtree(tempdir())
-        del tempdir.dirname
-
-def ocr2xml(pdffile, xmlfile, keep_tempfiles=False, write_hocr=False):
-    """ocr pdffile and write pdftohtml-type parsing to xmlfile"""
+def ocr2xml(pdffile, xmlfile, keep_tempfiles=False, write_hocr=False, pages=None):
+    """
+    ocr pdffile and write pdftohtml-type parsing to xmlfile; if
+    <pages> is given, only these pages (a list of page numbers) are
+    processed. keep_tempfiles is ignored, as we don't create any.
+    """
 
     start_time = timer()
     debug(2, "ocr2xml %s %s", pdffile, xmlfile)
 
-    try:
-        numpages = int(pdfinfo(pdffile)['Pages'])
-    except e:
-        raise MalformedPDFError('pdfinfo failed')
-    debug(2, '%s pages to process', numpages)
+    if not pages:
+        try:
+            numpages = int(pdfinfo(pdffile)['Pages'])
+        except Exception:
+            raise MalformedPDFError('pdfinfo failed')
+        pages = range(1, numpages+1)
+    debug(2, '%s pages to process', len(pages))
     
+    # The pages are processed in parallel; the work is done by
+    # pdftoppm and tesseract, so threads are enough here. Several
+    # scraper workers may be OCR-ing at once, so by default each gets
+    # its share of the cores:
+    workers = min(len(pages), config.get('ocr_workers') or default_workers())
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        page_hocrs = list(executor.map(lambda p: ocr_page(pdffile, p, workers), pages))
+
     xml = init_xml()
-    hocr = b''
-    for p in range(numpages):
-        page_hocr = ocr_page(pdffile, p+1)
+    for page_hocr in page_hocrs:
         xml_add_page(xml, page_hocr)
-        hocr += page_hocr
 
-    xmlstr = lxml.etree.tostring(xml, encoding='utf-8', pretty_print=True,
-                                 xml_declaration=True)
     if write_hocr:
         with open(xmlfile, 'wb') as f:
-            f.write(hocr)
+            f.write(b''.join(page_hocrs))
     else:
-        with open(xmlfile, 'wb') as f:
-            f.write(xmlstr)
-        doctidy(xmlfile)
+        xmlstr = lxml.etree.tostring(xml, encoding='utf-8', pretty_print=True,
+                                     xml_declaration=True)
+        with open(xmlfile, 'w', encoding='utf-8') as f:
+            f.write(doctidy_xml(xmlstr.decode('utf-8')))
 
     end_time = timer()
-    if not keep_tempfiles:
-        debug(3, 'cleaning up')
-        remove_tempdir()
-
     debug(2, 'Time: %s seconds', str(end_time - start_time))
 
-def ocr_page(pdffile, pagenum):
-    """ return (binary) hocr output for single page """
-    tempbase = join(tempdir(), basename(pdffile)+'.'+str(pagenum))
-    
-    debug(2, 'extracting page %s', pagenum) 
-    pagepdf = tempbase+'.pdf'
-    cmd = [PDFSEPARATE, '-f', str(pagenum), '-l', str(pagenum), pdffile, pagepdf]
-    debug(3, ' '.join(cmd))
-    subprocess.check_call(cmd, timeout=2)
-    
-    debug(2, 'converting page to image') 
-    pageppm = tempbase+'.ppm'
-    cmd = [PDFTOPPM, '-r', str(OCR_DPI), pagepdf]
-    debug(3, '%s > %s', ' '.join(cmd), pageppm)
-    with open(pageppm, 'wb') as f:
-        subprocess.check_call(cmd, stdout=f, timeout=5)
-    
-    debug(2, 'ocr-ing image') 
-    cmd = [TESSERACT, pageppm, 'stdout', '-l', 'eng', 'hocr']
-    debug(3, ' '.join(cmd))
-    output = subprocess.check_output(cmd, timeout=30)
+def default_workers():
+    """number of cores per scraper worker (see scraperpool)"""
+    cpus = os.cpu_count() or 1
+    return max(1, cpus // (config.get('scraper_workers') or cpus))
+
+def pages_in_ranges(ranges):
+    """
+    return sorted list of page numbers in <ranges>, e.g. [(1,3),(7,8)]
+    => [1,2,3,7,8]
+    """
+    return sorted(set(p for (start, end) in ranges for p in range(start, end+1)))
+
+def ocr_page(pdffile, pagenum, parallel=1):
+    """
+    return (binary) hocr output for single page; <parallel> is the
+    number of pages processed at the same time
+    """
+    debug(2, 'ocr-ing page %s', pagenum)
+    # render page to image and pipe it into tesseract:
+    cmd1 = [PDFTOPPM, '-r', str(OCR_DPI), '-f', str(pagenum), '-l', str(pagenum),
+            '-singlefile', pdffile]
+    cmd2 = [TESSERACT, 'stdin', 'stdout', '-l', 'eng', 'hocr']
+    debug(3, '%s | %s', ' '.join(cmd1), ' '.join(cmd2))
+    # several tesseract processes run at the same time, so each should
+    # only use one thread:
+    env = dict(os.environ, OMP_THREAD_LIMIT='1')
+    timeout = budget.step_timeout(35)
+    # the CPU budget is shared by the pdftoppm and tesseract processes
+    # of all pages that are processed in parallel:
+    share = 2 * parallel
+    ppm = subprocess.Popen(budget.limited(cmd1, share), stdout=subprocess.PIPE,
+                           stderr=subprocess.DEVNULL, start_new_session=True)
+    tess = subprocess.Popen(budget.limited(cmd2, share), stdin=ppm.stdout,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env,
+                            start_new_session=True)
+    ppm.stdout.close() # so that pdftoppm gets SIGPIPE if tesseract dies
+    try:
+        output, _ = tess.communicate(timeout=timeout)
+        ppm.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        budget.killpg(ppm)
+        budget.killpg(tess)
+        budget.check_exceeded(cmd2)
+        raise
+    if ppm.returncode != 0:
+        raise subprocess.CalledProcessError(ppm.returncode, cmd1)
+    if tess.returncode != 0:
+        raise subprocess.CalledProcessError(tess.returncode, cmd2)
     return output
 
 def init_xml():
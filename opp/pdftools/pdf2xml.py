@@ -5,9 +5,9 @@ import os
 from os.path import abspath, dirname, join, exists
 import subprocess
 from opp.debug import debug, debuglevel
-from .ocr2xml import ocr2xml
-from .doctidy import doctidy
-from .pdftools import pdfcut
+from opp import budget
+from .ocr2xml import ocr2xml, pages_in_ranges
+from .doctidy import doctidy_xml
 from opp.exceptions import *
 
 PDFTOHTML = '/usr/bin/pdftohtml'
@@ -15,13 +15,15 @@ PERL = '/usr/bin/perl'
 
 PATH = abspath(dirname(__file__))
 
-def pdf2xml(pdffile, xmlfile, keep_tempfiles=False, ocr_ranges=None):
+def pdf2xml(pdffile, xmlfile, keep_tempfiles=False, ocr_ranges=None, page_ranges=None):
     """
     converts pdf to xml using pdftohtml or, if that fails, ocr2xml;
     returns 'pdftohtml' or 'ocr2xml' depending on which process was
     used. ocr_ranges (optional) is a list of pairs such as
     [(1,3),(7,10)] which would specify that only pages 1-3 and 7-10
-    should get ocr'ed.
+    should get ocr'ed. page_ranges (optional) likewise restricts the
+    pdftohtml conversion (and ocr, if no ocr_ranges are given) to
+    some pages; used for very large documents.
             
     TODO: check quality to see if ocr is needed?
     """
@@ -29,50 +31,84 @@ def pdf2xml(pdffile, xmlfile, keep_tempfiles=False, ocr_ranges=None):
         raise FileNotFoundError('{} not found'.format(pdffile))
     # first try pdftohtml
     try:
-        pdftohtml(pdffile, xmlfile)
+        pdftohtml(pdffile, xmlfile, page_ranges=page_ranges)
         return 'pdftohtml'
     except NoTextInPDFException:
         debug(2, "no text in xml produced by pdftohtml")
     except Exception as e:
         debug(2, "pdftohtml failed: %s -- %s", pdffile, str(e))
     # then try ocr2xml (not catching exceptions here)
-    if ocr_ranges:
-        shortened_pdf = pdffile.rsplit('.')[0] + '-short.pdf'
-        pdfcut(pdffile, shortened_pdf, ocr_ranges)
-        pdffile = shortened_pdf
-    ocr2xml(pdffile, xmlfile, keep_tempfiles=keep_tempfiles)
-    if not keep_tempfiles and ocr_ranges:
-        try:
-            os.remove(shortened_pdf)
-        except:
-            pass
+    ocr_ranges = ocr_ranges or page_ranges
+    pages = pages_in_ranges(ocr_ranges) if ocr_ranges else None
+    ocr2xml(pdffile, xmlfile, keep_tempfiles=keep_tempfiles, pages=pages)
     return 'ocr2xml'
 
-def pdftohtml(pdffile, xmlfile):
+def pdftohtml(pdffile, xmlfile, page_ranges=None):
+    # The xml is kept in memory until it has been tidied, so that it
+    # is written to disk only once:
+    if page_ranges:
+        # pdftohtml only takes a single range (-f/-l), so we convert
+        # each range separately and merge the results:
+        xml = merge_xml([pdftohtml_xml(pdffile, first, last)
+                         for (first, last) in page_ranges])
+    else:
+        xml = pdftohtml_xml(pdffile)
+    if not xml_ok(xml):
+        debug(4, "No text in pdf: %s", xml)
+        raise NoTextInPDFException
+    else:
+        debug(3, "pdftohtml output ok")
+    writefile(xmlfile, doctidy_xml(fix_pdftohtml(xml)))
+
+def pdftohtml_xml(pdffile, first=None, last=None):
+    """return pdftohtml xml output for <pdffile> (pages <first>-<last>)"""
     cmd = [PDFTOHTML, 
            '-i',            # ignore images
            '-xml',          # xml output
+           '-stdout',
            '-enc', 'UTF-8',
-           '-nodrm',        # ignore copy protection
-           pdffile,
-           xmlfile]
+           '-nodrm']        # ignore copy protection
+    if first:
+        cmd += ['-f', str(first)]
+    if last:
+        cmd += ['-l', str(last)]
+    cmd.append(pdffile)
     debug(2, ' '.join(cmd))
     try:
-        stdout = subprocess.check_output(cmd, stderr=subprocess.STDOUT, timeout=10)
+        proc = budget.run(cmd, timeout=10, check=True)
     except subprocess.CalledProcessError as e:
-        debug(1, e.output)
+        debug(1, e.stderr)
         raise
-    if not exists(xmlfile):
-        raise PdftohtmlFailedException(stdout)
-    xml = readfile(xmlfile)
-    if not xml_ok(xml):
-        debug(4, "No text in pdf: %s", xml)
-        raise NoTextInPDFException
-    else:
-        debug(3, "pdftohtml output ok")
-    writefile(xmlfile, fix_pdftohtml(xml))
-    doctidy(xmlfile)
-    
+    xml = proc.stdout.decode('utf-8', 'replace')
+    if not xml:
+        raise PdftohtmlFailedException(proc.stderr)
+    return xml
+
+def merge_xml(xmls):
+    """
+    merge the pages of several pdftohtml xml outputs into the first
+    one. Font ids in later outputs are shifted so that they don't
+    clash with those in earlier outputs.
+    """
+    xml = xmls[0]
+    pages = []
+    num_fonts = font_count(xml)
+    for other in xmls[1:]:
+        shift = lambda m: '{}{}"'.format(m.group(1), int(m.group(2)) + num_fonts)
+        other = re.sub('(<fontspec id=")(\\d+)"', shift, other)
+        other = re.sub('(<text [^>]*?font=")(\\d+)"', shift, other)
+        pages.extend(re.findall('<page .+?</page>\\s*', other, re.DOTALL))
+        num_fonts = max(num_fonts, font_count(other))
+    end = xml.rfind('</pdf2xml>')
+    if end < 0:
+        end = len(xml)
+    return xml[:end] + ''.join(pages) + xml[end:]
+
+def font_count(xml):
+    """return 1 + the highest font id in pdftohtml <xml>"""
+    ids = [int(i) for i in re.findall('<fontspec id="(\\d+)"', xml)]
+    return max(ids) + 1 if ids else 0
+
 def xml_ok(xml):
     if not xml:
         return False
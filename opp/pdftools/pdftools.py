@@ -7,8 +7,10 @@ import tempfile
 import subprocess
 from functools import lru_cache
 from opp.debug import debug
+from opp import budget
 
 PDFINFO = '/usr/bin/pdfinfo'
+PDFTOTEXT = '/usr/bin/pdftotext'
 PDFSEPARATE = '/usr/bin/pdfseparate'
 GS = '/usr/bin/gs'
 PERL = '/usr/bin/perl'
@@ -32,7 +34,7 @@ def pdfinfo(filename):
     cmd = [PDFINFO, filename]
     debug(3, ' '.join(cmd))
     try:
-        output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, timeout=2)
+        output = budget.run(cmd, stderr=subprocess.STDOUT, timeout=2, check=True).stdout
         output = output.decode('utf-8')
     except subprocess.CalledProcessError as e:
         logger.warn(e.output)
@@ -44,6 +46,18 @@ def pdfinfo(filename):
             res[k] = v.strip()
     return res
 
+def pdftotext(filename, first=None, last=None):
+    '''returns plain text of pages <first>-<last> (default: all) of pdf'''
+    cmd = [PDFTOTEXT, '-q', '-enc', 'UTF-8']
+    if first:
+        cmd += ['-f', str(first)]
+    if last:
+        cmd += ['-l', str(last)]
+    cmd += [filename, '-']
+    debug(3, ' '.join(cmd))
+    output = budget.run(cmd, stderr=subprocess.DEVNULL, timeout=10, check=True).stdout
+    return output.decode('utf-8', 'replace')
+
 def pdfcut(filename, newfilename, pageranges, keep_tempfiles=False):
     '''
     extracts certain pages from filename and puts them into
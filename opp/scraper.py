@@ -8,19 +8,27 @@ import subprocess
 import shutil
 import tempfile
 import hashlib
+import uuid
+from types import SimpleNamespace
 from selenium.common.exceptions import *
 from MySQLdb._exceptions import IntegrityError # SFM
 # from _mysql_exceptions import IntegrityError # SFM
 from opp import db
 from opp import error
 from opp import util
+from opp import artifactcache
+from opp import budget
+from opp import minhash
+from opp.config import config
 from opp import philpaperssearch as pps
-from opp.models import Source, Link, Doc, categories
+from opp.models import Source, Link, Doc, categories, mark_clean, unit_of_work
 from opp.debug import debug
-from opp.browser import Browser, stop_browser, kill_all_browsers
+from opp.browser import Browser, stop_browser
+from opp.fetcher import Fetcher
 from opp.webpage import Webpage
-from opp.pdftools.pdftools import pdfinfo
+from opp.pdftools.pdftools import pdfinfo, pdftotext
 from opp.pdftools.pdf2xml import pdf2xml
+from opp.pdftools.doc2pdf import doc2pdf
 from opp.exceptions import *
 
 # Probably the source override should be by source ID rather than URL.
@@ -29,63 +37,91 @@ METADATA_OVERRIDE_SOURCES = [
 ]
 
 
-def next_source():
-    """return the next source from db that's due to be checked"""
+# source pages whose static html has fewer links than this are
+# suspected to require javascript:
+MIN_STATIC_ANCHORS = 5
+
+# how long a claimed source is reserved for the claiming scraper:
+LEASE_SECS = config.get('source_lease_secs', 2*60*60)
+
+# A scrape can take longer than that (up to 50 new links, each with
+# its own processing budget), so the lease is renewed during the
+# scrape, whenever this many seconds have passed since it was claimed
+# or last renewed:
+LEASE_RENEW_SECS = LEASE_SECS / 4
+
+def claim_sources(num, lease_secs=LEASE_SECS):
+    """
+    claim up to <num> sources that are due to be checked; returns list
+    of Source objects.
+
+    Claimed sources are leased to the caller: they get a random
+    lease_token and a lease_expires date, and other scrapers (possibly
+    on other machines) won't claim them until the lease has expired
+    or been released with Source.release_lease(). Since the claim is a
+    single UPDATE statement, no two scrapers can claim the same
+    source.
+    """
 
     debug(1, '*'*50)
-    
+
+    # Due sources, in order of priority:
+    #
     # First priority: process newly found pages so that we can better
     # decide whether they're genuine source pages or not. (We don't
     # restrict to confirmed == 0 so that we also catch manually added
-    # and thus already confirmed pages.)
-    cur = db.dict_cursor()
-    query = ("SELECT * FROM sources WHERE"
-             " (status = 0 OR last_checked IS NULL)" 
-             " AND sourcetype != 'blog'"
-             " LIMIT 1")
-    cur.execute(query)
-    if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
-    sources = cur.fetchall()
-    if sources:
-        debug(1, "processing new source")
-        return Source(**sources[0])
-        # If a page isn't confirmed yet, then after processing, it
-        # will have a last_checked date and status > 0, but still
-        # confirmed = 0. From then on, it will be processed just like
-        # other pages (below), but new links won't show up in the feed
-        # until it is confirmed.
-    
-    # Second priority: process working pages.
-    min_age = datetime.now() - timedelta(hours=16)
-    min_age = min_age.strftime('%Y-%m-%d %H:%M:%S')
-    query = ("SELECT * FROM sources WHERE status = 1"
-             " AND sourcetype != 'blog'"
-             " AND last_checked < %s"
-             " ORDER BY last_checked LIMIT 1")
-    cur.execute(query, (min_age,))
-    if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
-    sources = cur.fetchall()
-    if sources:
-        return Source(**sources[0])
-
+    # and thus already confirmed pages.) If a page isn't confirmed
+    # yet, then after processing, it will have a last_checked date
+    # and status > 0, but still confirmed = 0. From then on, it will
+    # be processed just like other pages (below), but new links won't
+    # show up in the feed until it is confirmed.
+    #
+    # Second priority: process working pages whose next_check date
+    # has arrived (see Source.revisit_hours).
+    #
     # Third priority: occasionally re-test broken pages to decide
     # whether we should remove them for good. (Want to give
     # maintainers a few days to fix things.)
-    min_age = datetime.now() - timedelta(hours=96)
-    min_age = min_age.strftime('%Y-%m-%d %H:%M:%S')
-    query = ("SELECT * FROM sources WHERE status > 1"
-             " AND sourcetype != 'blog'"
-             " AND last_checked < %s"
-             " ORDER BY last_checked LIMIT 1")
-    cur.execute(query, (min_age,))
+    #
+    # Pages that have been checked before next_check dates were
+    # introduced are re-checked after 16 or 96 hours respectively.
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    min_age_ok = datetime.now() - timedelta(hours=16)
+    min_age_ok = min_age_ok.strftime('%Y-%m-%d %H:%M:%S')
+    min_age_broken = datetime.now() - timedelta(hours=96)
+    min_age_broken = min_age_broken.strftime('%Y-%m-%d %H:%M:%S')
+    token = uuid.uuid4().hex
+    cur = db.cursor()
+    query = ("UPDATE sources SET lease_token = %s,"
+             " lease_expires = NOW() + INTERVAL %s SECOND"
+             " WHERE sourcetype != 'blog'"
+             " AND (lease_expires IS NULL OR lease_expires < NOW())"
+             " AND ((status = 0 OR last_checked IS NULL)"
+             "      OR (status > 0 AND next_check < %s)"
+             "      OR (next_check IS NULL AND status = 1 AND last_checked < %s)"
+             "      OR (next_check IS NULL AND status > 1 AND last_checked < %s))"
+             " ORDER BY CASE WHEN status = 0 OR last_checked IS NULL THEN 0"
+             "               WHEN status = 1 THEN 1 ELSE 2 END,"
+             "          COALESCE(next_check, last_checked)"
+             " LIMIT %s")
+    cur.execute(query, (token, lease_secs, now, min_age_ok, min_age_broken, num))
     if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
-    sources = cur.fetchall()
-    if sources:
-        debug(1, "re-checking broken source")
-        return Source(**sources[0])
-
-    debug(1, "all pages recently checked")
-    return None
+    db.commit()
+    if not cur.rowcount:
+        debug(1, "all pages recently checked")
+        return []
+    cur = db.dict_cursor()
+    query = "SELECT * FROM sources WHERE lease_token = %s"
+    cur.execute(query, (token,))
+    if hasattr(cur,"_last_executed"): debug(4, cur._last_executed)
+    sources = [Source(**row) for row in cur.fetchall()]
+    for source in sources:
+        mark_clean(source)
+        if source.status == 0 or not source.last_checked:
+            debug(1, "processing new source %s", source.url)
+        elif source.status > 1:
+            debug(1, "re-checking broken source %s", source.url)
+    return sources
 
 def scrape(source, keep_tempfiles=False):
     """
@@ -131,23 +167,39 @@ def scrape(source, keep_tempfiles=False):
 
     debug(1, "checking links on %s", source.url)
 
-    # go to page:
-    browser = Browser()
-    try:
-        browser.goto(source.url)
-    except Exception as e:
-        debug(1, 'connection to source %s failed: %s', source.url, str(e))
-        #source.mark_as_dead(browser.status or error.code['unknown browser error'])
-        if browser.status == 900 and 'connection' in str(e):
-            debug(1, 'killing browser')
-            stop_browser()
-            kill_all_browsers()
-            time.sleep(10)
-        else:
-            source.mark_as_dead(browser.status or 901)
-        return 0
+    # go to page: most source pages are static html, which we can
+    # fetch over plain HTTP; only if the page is known or suspected to
+    # require javascript do we load it in the browser.
+    browser = None
+    r = fetch_static(source)
+    if r:
+        page_url = r.url
+        page_html = r.text
+    else:
+        browser = Browser()
+        try:
+            browser.goto(source.url)
+        except Exception as e:
+            debug(1, 'connection to source %s failed: %s', source.url, str(e))
+            #source.mark_as_dead(browser.status or error.code['unknown browser error'])
+            if browser.status == 900 and 'connection' in str(e):
+                # Only stop our own browser: other scraper workers may
+                # be running browsers on this host.
+                debug(1, 'stopping browser')
+                stop_browser()
+            else:
+                source.mark_as_dead(browser.status or 901)
+            return 0
+        page_url = browser.current_url
+        try:
+            page_html = browser.page_source
+        except WebDriverException as e:
+            debug(1, 'webdriver error retrieving page source: %s', e)
+            source.update_db(status=error.code['cannot parse document'])
+            return 0
+        remember_js_required(source, page_html)
 
-    if browser.current_url != source.url:
+    if page_url != source.url:
         # redirects of journal pages are OK (e.g. from /current to
         # /nov-2015), but redirects of personal papers pages are often
         # caused by pages having disappeared; the redirect can then
@@ -158,45 +210,35 @@ def scrape(source, keep_tempfiles=False):
         if source.sourcetype == 'personal':
             def urlfrag(url):
                 return url.split('//', 2)[1].replace('www.', '').rstrip('/')
-            if urlfrag(browser.current_url) == urlfrag(source.url):
+            if urlfrag(page_url) == urlfrag(source.url):
                 debug(1, "%s redirects to variant %s; updating source record",
-                      source.url, browser.current_url)
+                      source.url, page_url)
                 try:
-                    source.update_db(url=browser.current_url)
+                    source.update_db(url=page_url)
                 except: # ignore duplicate url error
                     pass
             else:
-                debug(1, '%s redirects to %s', source.url, browser.current_url)
+                debug(1, '%s redirects to %s', source.url, page_url)
                 source.update_db(status=301)
-                target = Source(url=browser.current_url,
+                target = Source(url=page_url,
                                 default_author=source.default_author,
                                 name=source.name)
                 for dupe in target.get_duplicates():
                     debug(1, "redirect url already in db as %s", dupe.url)
                     break
                 else:
-                    try:
-                        target.set_html(browser.page_source)
-                    except WebDriverException as e:
-                        debug(1, 'webdriver error retrieving page source: %s', e)
+                    target.set_html(page_html)
+                    if target.compute_p_is_source() < 60:
+                        debug(1, "target doesn't look like a source page")
                     else:
-                        if target.compute_p_is_source() < 60:
-                            debug(1, "target doesn't look like a source page")
-                        else:
-                            debug(1, "adding target as potential new source page")
-                            target.save_to_db()
+                        debug(1, "adding target as potential new source page")
+                        target.save_to_db()
                 return 0
         else:
-            debug(2, 'following redirect to %s', browser.current_url)
+            debug(2, 'following redirect to %s', page_url)
 
     # extract links:
-    try:
-        source.set_html(browser.page_source)
-    except WebDriverException as e:
-        debug(1, 'webdriver error retrieving page source: %s', e)
-        source.update_db(status=error.code['cannot parse document'])
-        return 0 
-
+    source.set_html(page_html)
     source.extract_links(browser)
     
     # Selenium doesn't tell us when a site yields a 404, 401, 500
@@ -218,17 +260,23 @@ def scrape(source, keep_tempfiles=False):
     
     # process new links:
     if source.new_links:
-        for i,li in enumerate(source.new_links):
-            if i < 50:
-                debug(1, '-'*80)
-                debug(1, '*** processing new link to %s on %s ***', li.url, source.url)
-                process_link(li)
-            else:
-                # sourcesfinder sometimes digs up archive pages with
-                # thousands of links; we don't want to process them all
-                # before we finally remove the page.
-                debug(1, '*** ignoring new link to %s on %s ***', li.url, source.url)
-                li.update_db(status=1, doc_id=None)
+        new_links = list(source.new_links)
+        # sourcesfinder sometimes digs up archive pages with
+        # thousands of links; we don't want to process them all
+        # before we finally remove the page.
+        for li in new_links[50:]:
+            debug(1, '*** ignoring new link to %s on %s ***', li.url, source.url)
+        Link.save_all(new_links[50:], status=1, doc_id=None)
+        # the links are downloaded in the background while we
+        # process those that have already arrived. The writes for
+        # each link are committed together, so that no row stays
+        # locked for longer than it takes to process one link:
+        for li, response in Fetcher().fetch_all(new_links[:50], download_dir=tempdir()):
+            debug(1, '-'*80)
+            debug(1, '*** processing new link to %s on %s ***', li.url, source.url)
+            source.renew_lease(LEASE_SECS, min_interval=LEASE_RENEW_SECS)
+            with unit_of_work():
+                process_link(li, response=response)
     
     else:
         debug(1, "no new links")
@@ -240,7 +288,9 @@ def scrape(source, keep_tempfiles=False):
             if tdelta.days < 5:
                 debug(1, 're-checking recent link %s on %s with status %s', 
                       li.url, source.url, li.status)
-                process_link(li, force_reprocess=True)
+                source.renew_lease(LEASE_SECS, min_interval=LEASE_RENEW_SECS)
+                with unit_of_work():
+                    process_link(li, force_reprocess=True)
     
     # re-check old links to papers for revisions:
     #MAX_REVCHECK = 3
@@ -279,11 +329,69 @@ def scrape(source, keep_tempfiles=False):
         source.mark_as_dead(error.code['no links to documents on source page'])
         return 0
     
-    source.update_db(num_doclinks=source.num_doclinks, status=1)
+    # adjust revisit schedule to how often new links appear on the
+    # page (unless this is the first time we process the page, in
+    # which case all links are new):
+    if source.status == 1:
+        source.update_change_rate(len(source.new_links))
+    source.update_db(num_doclinks=source.num_doclinks, status=1,
+                     change_rate=source.change_rate)
     return 1
 
+def fetch_static(source):
+    """
+    fetch source page over plain HTTP unless it is known or suspected
+    to require javascript; returns response object, or None if the
+    page should be loaded in the browser.
+
+    If we don't yet know whether the page requires javascript and
+    the static html has hardly any links, we suspect that the links
+    are generated by javascript. In that case, the number of static
+    links is stored in source.num_static_anchors so that, once the page
+    has been loaded in the browser, remember_js_required() can decide
+    whether the browser was really needed.
+    """
+    if source.js_required:
+        return None
+    status, r = util.request_url(source.url)
+    if status != 200 or r.filetype != 'html':
+        debug(2, "cannot fetch %s over HTTP (status %s); using browser",
+              source.url, status)
+        if status == 403 and source.js_required is None:
+            # perhaps blocking non-browser clients
+            source.num_static_anchors = 0
+        return None
+    if 'charset' not in r.headers.get('content-type', '').lower():
+        r.encoding = r.apparent_encoding
+    num_anchors = count_anchors(r.text)
+    if source.js_required is None and num_anchors < MIN_STATIC_ANCHORS:
+        debug(2, "only %s links in static html; using browser", num_anchors)
+        source.num_static_anchors = num_anchors
+        return None
+    debug(2, "fetched source page over HTTP")
+    return r
+
+def remember_js_required(source, browser_html):
+    """
+    after loading a suspicious source page in the browser, store
+    whether the browser found more links than the static html
+    """
+    if not hasattr(source, 'num_static_anchors'):
+        return
+    num_anchors = count_anchors(browser_html)
+    js_required = num_anchors >= max(MIN_STATIC_ANCHORS, 2*source.num_static_anchors)
+    debug(2, "%s links in static html, %s in browser: javascript %s",
+          source.num_static_anchors, num_anchors,
+          'required' if js_required else 'not required')
+    source.js_required = int(js_required)
+    source.update_db(js_required=source.js_required)
+
+def count_anchors(html):
+    """return (rough) number of links in html source"""
+    return len(re.findall(r'<a\s[^>]*href', html, re.I))
+
 def process_link(li, force_reprocess=False, redir_url=None, keep_tempfiles=False,
-                 recurse=0):
+                 recurse=0, response=None):
     """
     Fetch url, check for http errors and steppingstones, filter spam,
     parse candidate papers, check for duplicates, check if paper is old.
@@ -297,13 +405,12 @@ def process_link(li, force_reprocess=False, redir_url=None, keep_tempfiles=False
 
     If force_reprocess is False and the link has already been checked
     at some point, if_modified_since and etag headers are sent.
+
+    If the link target has already been downloaded (see opp.fetcher),
+    the (status, response) pair is passed as <response>.
     """
     if not hasattr(li, 'context'): # skip context extraction on redirects
-        try:
-            li.context = li.html_context()
-        except StaleElementReferenceException:
-            debug(2, "link element has disappeared")
-            return li.update_db(status=1, doc_id=None)
+        li.context = li.html_context()
         debug(2, "link context: %s", li.context)
     
         # ignore links to old and published papers:
@@ -328,7 +435,9 @@ def process_link(li, force_reprocess=False, redir_url=None, keep_tempfiles=False
     
     # fetch url and handle errors, redirects, etc.:
     url = redir_url or li.url
-    r = li.fetch(url=url, only_if_modified=not(force_reprocess))
+    r = li.fetch(url=url, only_if_modified=not(force_reprocess),
+                 response=None if redir_url else response,
+                 download_dir=tempdir())
     # note: li.fetch() updates the link entry in case of errors
     if not r:
         debug(2, "failed to load %s", url)
@@ -394,12 +503,19 @@ def process_link(li, force_reprocess=False, redir_url=None, keep_tempfiles=False
             debug(1, "document already stored under id %s", old_id)
             li.update_db(status=1, doc_id=old_id)
             return 0
-        try:
-            # metadata extraction:
-            process_file(doc, keep_tempfiles=keep_tempfiles)
-        except Exception as e:
-            debug(1, 'could not process %s: %s', doc.tempfile, e)
-            return li.update_db(status=error.code.get(str(e), 10))
+        # triage and metadata extraction share a budget of time and
+        # memory, so that a bad document can't block the scraper:
+        with budget.document_budget() as doc_budget:
+            try:
+                if not triage(doc):
+                    li.update_db(status=1)
+                    return 0
+                process_file(doc, keep_tempfiles=keep_tempfiles)
+            except Exception as e:
+                debug(1, 'could not process %s: %s', doc.tempfile, e)
+                if doc_budget.exceeded():
+                    return li.update_db(status=error.code['processing budget exceeded'])
+                return li.update_db(status=error.code.get(str(e), 10))
     
     # estimate whether doc is a handout, cv etc.:
     from .doctyper import paperfilter
@@ -497,6 +613,88 @@ def process_link(li, force_reprocess=False, redir_url=None, keep_tempfiles=False
 
     return 1
 
+# Documents that score below these values in triage() are rejected
+# without running the full pipeline (the thresholds applied after
+# metadata extraction are 25):
+TRIAGE_MIN_PAPER = 10
+TRIAGE_MIN_PHILOSOPHY = 10
+
+def triage(doc):
+    """
+    quickly checks if <doc> could be a paper on philosophy, before
+    running the expensive conversion and metadata extraction: we run
+    paperfilter and the philosophy classifier on the plain text of
+    the first and last pages. Returns False if <doc> is almost
+    certainly not a paper on philosophy, otherwise True.
+
+    Only pdf files with a text layer are checked.
+    """
+    if doc.filetype != 'pdf':
+        return True
+    try:
+        numpages = int(pdfinfo(doc.tempfile)['Pages'])
+        if numpages > 5:
+            text = pdftotext(doc.tempfile, 1, 3) + pdftotext(doc.tempfile, numpages-1, numpages)
+            sample_pages = 5
+        else:
+            text = pdftotext(doc.tempfile)
+            sample_pages = numpages
+    except Exception as e:
+        debug(1, "triage failed: %s", e)
+        return True
+    numwords = len(text.split())
+    if numwords < 100:
+        # probably needs ocr
+        return True
+    sample = SimpleNamespace(
+        url=doc.url, link=doc.link, filetype=doc.filetype,
+        title='', authors='', content=text, numpages=numpages,
+        # extrapolate numwords as process_file does for ocr'ed pages:
+        numwords=int(numwords * numpages / sample_pages),
+        # we don't have extractor information; Ellipsis makes
+        # paperfilter skip the meta_confidence feature:
+        meta_confidence=Ellipsis)
+
+    from .doctyper import paperfilter
+    is_paper = int(paperfilter.evaluate(sample) * 100)
+    debug(2, "triage: paper score %s", is_paper)
+    if is_paper < TRIAGE_MIN_PAPER:
+        debug(1, "spam (triage): paper score %s < %s", is_paper, TRIAGE_MIN_PAPER)
+        return False
+    from .doctyper import classifier
+    try:
+        is_philosophy = int(classifier.get_classifier('philosophy').classify(sample) * 100)
+    except UntrainedClassifierException:
+        return True
+    debug(2, "triage: philosophy score %s", is_philosophy)
+    if is_philosophy < TRIAGE_MIN_PHILOSOPHY:
+        debug(1, "spam (triage): philosophy score %s < %s", is_philosophy, TRIAGE_MIN_PHILOSOPHY)
+        return False
+    return True
+
+# Of very large documents (books, theses), only some pages at the
+# beginning and end are converted to xml: metadata extraction only
+# looks at the beginning, and the classifiers at the first and last
+# 50000 characters. Word counts are extrapolated from these pages.
+LARGE_PDF = dict({
+    'min_pages': 80,  # documents with more pages count as large
+    'head_pages': 20, # convert this many pages at the beginning
+    'tail_pages': 15, # and this many at the end
+}, **config.get('large_pdf', {}))
+
+def page_windows(numpages):
+    """
+    return list of page ranges to convert for a document with
+    <numpages> pages, or None if the whole document is converted
+    """
+    if numpages < LARGE_PDF['min_pages']:
+        return None
+    head = min(LARGE_PDF['head_pages'], numpages)
+    tail = max(numpages - LARGE_PDF['tail_pages'] + 1, head + 1)
+    if tail > numpages:
+        return None
+    return [(1, head), (tail, numpages)]
+
 def process_file(doc, keep_tempfiles=False):
     """
         converts document to pdf, then xml, then extracts metadata
@@ -506,12 +704,21 @@ def process_file(doc, keep_tempfiles=False):
     """
     
     
+    if not doc.filehash:
+        doc.filehash = artifactcache.file_hash(doc.tempfile)
+    artifactcache.put(doc.filehash, 'original.'+doc.filetype, doc.tempfile)
+
     if doc.filetype != 'pdf':
         # convert to pdf
-        try:
-            doc.tempfile = convert_to_pdf(doc.tempfile)
-        except:
-            raise Exception("pdf conversion failed")
+        pdffile = doc.tempfile.rsplit('.',1)[0]+'.pdf'
+        if artifactcache.get(doc.filehash, 'converted.pdf', dest=pdffile):
+            doc.tempfile = pdffile
+        else:
+            try:
+                doc.tempfile = convert_to_pdf(doc.tempfile)
+            except:
+                raise Exception("pdf conversion failed")
+            artifactcache.put(doc.filehash, 'converted.pdf', doc.tempfile)
 
     # get pdf info:
     try:
@@ -528,27 +735,38 @@ def process_file(doc, keep_tempfiles=False):
         ocr_ranges = [(1,3), (doc.numpages-2,doc.numpages)]
     else:
         ocr_ranges = None
-    try:
-        engine = pdf2xml(doc.tempfile, doc.xmlfile, 
-                         keep_tempfiles=keep_tempfiles,
-                         ocr_ranges=ocr_ranges)
-    except Exception as e:
-        debug(1, "converting pdf to xml failed: %s", e)
-        raise Exception('pdf conversion failed')
+    page_ranges = page_windows(doc.numpages)
+    if page_ranges:
+        debug(2, 'large document: converting only pages %s', page_ranges)
+    # the cached xml depends on which pages were converted:
+    xmlsuffix = ''.join('-{}-{}'.format(*r) for r in page_ranges or []) + '.xml'
+    engine = None
+    for cached_engine in ('pdftohtml', 'ocr2xml'):
+        if artifactcache.get(doc.filehash, cached_engine+xmlsuffix, dest=doc.xmlfile):
+            engine = cached_engine
+            break
+    if not engine:
+        try:
+            engine = pdf2xml(doc.tempfile, doc.xmlfile, 
+                             keep_tempfiles=keep_tempfiles,
+                             ocr_ranges=ocr_ranges,
+                             page_ranges=page_ranges)
+        except Exception as e:
+            debug(1, "converting pdf to xml failed: %s", e)
+            raise Exception('pdf conversion failed')
+        artifactcache.put(doc.filehash, engine+xmlsuffix, doc.xmlfile)
 
     # read some basic metadata from xml file: 
-    doc.content = util.text_content(doc.xmlfile)
+    doc.content, numwords, page_offsets = util.text_pages(doc.xmlfile)
     debug(5, "text content:\n%s", doc.content)
-    if engine == 'pdftohtml':
-        doc.numwords = len(doc.content.split())
-    else:
+    if engine == 'ocr2xml':
         doc.ocr = True
-        if doc.numpages > 10:
-            # extrapolate numwords from numpages and the number of words
-            # on the ocr'ed pages:
-            doc.numwords = len(doc.content.split()) * doc.numpages/10
-        else:
-            doc.numwords = len(doc.content.split())
+    if doc.numpages > len(page_offsets) > 0:
+        # extrapolate numwords from numpages and the number of words
+        # on the converted (or ocr'ed) pages:
+        doc.numwords = int(numwords * doc.numpages / len(page_offsets))
+    else:
+        doc.numwords = numwords
     if doc.numwords == 0:
         raise Exception('pdf conversion failed')
 
@@ -645,26 +863,24 @@ def save_local(r):
     fname = re.sub('\W', '_', fname) + '.' + r.filetype
     temppath = os.path.join(tempdir(), fname)
     debug(2, "saving %s to %s", r.url, temppath)
-    md5 = hashlib.md5()
     try:
+        if getattr(r, 'localfile', None):
+            # already downloaded to disk (and hashed) by util.request_url:
+            shutil.move(r.localfile, temppath)
+            r.localfile = temppath
+            return (temppath, r.filehash)
         with open(temppath, 'wb') as f:
-            for block in r.iter_content(1024):
-                f.write(block)
-                md5.update(block)
+            f.write(r.content)
     except EnvironmentError as e:
         debug(1, "cannot save %s to %s: %s", r.url, temppath, str(e))
         raise
-    return (temppath, md5.hexdigest())
+    return (temppath, hashlib.md5(r.content).hexdigest())
     
 def convert_to_pdf(tempfile):
     outfile = tempfile.rsplit('.',1)[0]+'.pdf'
     try:
-        cmd = ['/usr/bin/python3', '/usr/bin/unoconv', 
-                '-f', 'pdf', '-o', outfile, tempfile]
-        # cmd = ['/usr/bin/python3', '/usr/bin/unoserver', 
-        #        '-f', 'pdf', '-o', outfile, tempfile]
-        debug(2, ' '.join(cmd))
-        subprocess.check_call(cmd, timeout=20)
+        # uses resident soffice processes, see pdftools/doc2pdf.py:
+        doc2pdf(tempfile, outfile)
     except Exception as e:
         debug(1, "cannot convert %s to pdf: %s", tempfile, str(e))
         raise
@@ -681,6 +897,10 @@ def remove_tempdir():
         shutil.rmtree(tempdir.dirname)
         del tempdir.dirname
         
+# documents whose contents have at least this (estimated) Jaccard
+# similarity count as duplicates, see opp.minhash:
+DUPLICATE_MIN_SIMILARITY = 0.3
+
 def get_duplicate(doc):
     """
     returns a document from db that closely resembles doc, or None
@@ -689,39 +909,43 @@ def get_duplicate(doc):
     # different titles (e.g. with and without <i>), different
     # filesize and wordcount (manuscript vs published version),
     # different authors and abstracts (due to parser mistakes,
-    # author name variants, etc.).
+    # author name variants, etc.). So we compare the contents, using
+    # the minhash index to find documents with similar content. Short
+    # or formulaic documents can have similar content without being
+    # duplicates, so the candidates must also share the first title
+    # word and the first author's surname.
     debug(5, "checking for duplicates")
-    where = ['doc_id != %s']
-    values = [doc.doc_id]
-    m = re.search('\w\w\w\w+', doc.title) # first title word
-    if m:
-        where.append('title LIKE %s') 
-        values.append('%'+m.group()+'%')
-    m = re.search('(\w\w+)(?:,|$)', doc.authors) # first author surname
-    if m:
-        where.append('authors LIKE %s')
-        values.append('%'+m.group(1)+'%')
-    if len(values) < 3:
-        # don't check entire database if no title or author provided
+    title_word = re.search(r'\w\w\w\w+', doc.title or '')
+    surname = re.search(r'(\w\w+)(?:,|$)', doc.authors or '')
+    if not title_word and not surname:
+        # too little to tell if a candidate is plausible
         return None
+    candidates = minhash.similar_docs(doc.content, min_similarity=DUPLICATE_MIN_SIMILARITY,
+                                      exclude_id=doc.doc_id)
     cur = db.dict_cursor()
-    query = "SELECT * FROM docs WHERE status=1 AND " + (' AND '.join(where))
-    query += " LIMIT 100"
-    cur.execute(query, values)
-    if hasattr(cur,"_last_executed"): debug(5, cur._last_executed)
-    dupes = cur.fetchall()
-    for dupe in dupes:
+    for (doc_id, similarity) in candidates:
+        query = "SELECT * FROM docs WHERE doc_id = %s AND status = 1"
+        cur.execute(query, (doc_id,))
+        if hasattr(cur,"_last_executed"): debug(5, cur._last_executed)
+        rows = cur.fetchall()
+        if not rows:
+            continue
+        dupe = rows[0]
         debug(5, "candidate: %s, '%s'", dupe['authors'], dupe['title'])
-        if abs(doc.numwords - dupe['numwords']) / doc.numwords > 0.2:
-            debug(5, "length not close enough")
+        if title_word and title_word.group().lower() not in (dupe['title'] or '').lower():
+            debug(5, "title doesn't match")
+            continue
+        if surname and surname.group(1).lower() not in (dupe['authors'] or '').lower():
+            debug(5, "authors don't match")
             continue
-        sm = SequenceMatcher(None, doc.content, dupe['content'])
-        match_ratio = sm.ratio()
-        if match_ratio < 0.1: # sic
-            debug(5, "content too different, ratio %s", match_ratio)
+        if abs(doc.numwords - dupe['numwords']) > 0.2 * doc.numwords:
+            debug(5, "length not close enough")
             continue
-        debug(4, "duplicate: %s, '%s'", dupe['authors'], dupe['title'])
-        return Doc(**dupe)
+        debug(4, "duplicate: %s, '%s' (similarity %s)", dupe['authors'], dupe['title'],
+              similarity)
+        dupe = Doc(**dupe)
+        mark_clean(dupe)
+        return dupe
     return None
 
 def context_suggests_published(context):
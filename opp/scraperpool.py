@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import signal
+import multiprocessing
+import MySQLdb
+from opp import db, scraper, browser
+from opp.config import config
+from opp.models import Source, mark_clean
+from opp.pdftools import doc2pdf
+from opp.docparser import extractorpool
+from opp.debug import debug, debuglevel
+
+"""
+Scrape several source pages at once.
+
+The pool forks a number of worker processes. Each worker has its own
+browser, temporary directory and database connection (all of which
+are process globals in opp.browser, opp.scraper and opp.db). The
+parent process acts as scheduler: it claims a batch of due sources
+from the db (see scraper.claim_sources) and hands each of them to an
+idle worker, which releases the source's lease when it is done.
+"""
+
+# pause between two sources processed by the same worker:
+PAUSE_SECS = 10
+
+# how long to wait for busy workers to finish when stopping:
+STOP_TIMEOUT = 120
+
+def worker(tasks, results, level):
+    """
+    scrape sources from <tasks> queue until we receive None; the
+    source_id of each processed source is put into <results>
+    """
+    # the daemon's signal handlers are inherited; we want SIGTERM to
+    # end the worker and leave SIGINT to the parent:
+    def exit_worker(signum, frame):
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, exit_worker)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    debuglevel(level)
+    debug(2, "worker %s started", os.getpid())
+    try:
+        while True:
+            fields = tasks.get()
+            if fields is None:
+                break
+            source = Source(**fields)
+            mark_clean(source) # fields are as stored in the db
+            try:
+                scraper.scrape(source)
+            except Exception as e:
+                debug(1, "error scraping %s: %s", source.url, e)
+            source.release_lease()
+            time.sleep(PAUSE_SECS)
+            results.put(source.source_id)
+    finally:
+        browser.stop_browser()
+        doc2pdf.stop_listeners()
+        extractorpool.stop_workers()
+        scraper.remove_tempdir()
+        debug(2, "worker %s stopped", os.getpid())
+
+class Worker():
+    """parent-side handle for a worker process"""
+
+    def __init__(self, ctx, results):
+        self.tasks = ctx.Queue()
+        self.source = None # source currently being scraped
+        self.process = ctx.Process(target=worker,
+                                   args=(self.tasks, results, debuglevel()),
+                                   daemon=True)
+        self.process.start()
+
+class ScraperPool():
+
+    def __init__(self, num_workers=None):
+        self.num_workers = (num_workers or config.get('scraper_workers')
+                            or os.cpu_count())
+        self.ctx = multiprocessing.get_context('fork')
+        self.results = self.ctx.Queue()
+        self.workers = []
+
+    def start(self):
+        debug(1, "starting %s scraper workers", self.num_workers)
+        for i in range(self.num_workers):
+            self.workers.append(self.new_worker())
+
+    def new_worker(self):
+        # the workers must not share our db connection:
+        db.close()
+        return Worker(self.ctx, self.results)
+
+    def collect(self):
+        """register finished sources and replace dead workers"""
+        while not self.results.empty():
+            source_id = self.results.get()
+            for w in self.workers:
+                if w.source and w.source.source_id == source_id:
+                    w.source = None
+        for i,w in enumerate(self.workers):
+            if not w.process.is_alive():
+                debug(1, "worker %s died while processing %s; restarting",
+                      w.process.pid, w.source.url if w.source else 'nothing')
+                if w.source:
+                    w.source.release_lease()
+                self.workers[i] = self.new_worker()
+
+    def dispatch(self):
+        """
+        hand out due sources to idle workers; returns the number of
+        idle workers for which no source was due
+        """
+        self.collect()
+        idle = [w for w in self.workers if not w.source]
+        if not idle:
+            return 0
+        try:
+            sources = scraper.claim_sources(len(idle))
+        except MySQLdb.OperationalError as e:
+            # e.g. lock wait timeout; try again in the next round
+            debug(1, "cannot claim sources: %s", e)
+            db.discard()
+            return len(idle)
+        for w,source in zip(idle, sources):
+            w.source = source
+            w.tasks.put({ k: getattr(source, k) for k in Source.db_fields })
+        return len(idle) - len(sources)
+
+    def stop(self):
+        debug(1, "stopping scraper workers")
+        for w in self.workers:
+            w.tasks.put(None)
+        deadline = time.time() + STOP_TIMEOUT
+        for w in self.workers:
+            w.process.join(max(deadline - time.time(), 1))
+            if w.process.is_alive():
+                debug(1, "terminating worker %s", w.process.pid)
+                w.process.terminate()
+                w.process.join()
+        self.workers = []
@@ -1,74 +1,194 @@
 #!/usr/bin/env python3
+import os
+import io
 import re
 import time
+import mmap
+import hashlib
+import tempfile
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from lxml import html
 from urllib.parse import urljoin
 from opp import error
+from opp.config import config
+
+# Emulate a web browser profile:
+HEADERS = {
+    'user-agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:37.0) Gecko/20100101 Firefox/37.0',
+    'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'accept-language': 'en-US,en;q=0.5'
+}
+
+# default settings for the http session, overridden by config['http']:
+HTTP_DEFAULTS = {
+    'pool_connections': 20, # number of hosts to keep connections to
+    'pool_maxsize': 4,      # idle connections kept per host
+    'retries': 2,           # retries on connection errors and retry_statuses
+    'backoff_factor': 0.5,  # sleep 0.5s, 1s, 2s... between retries
+    'retry_statuses': [429, 502, 503, 504],
+}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def session():
+    """
+    return the requests.Session shared by all http requests in this
+    process. The session keeps connections alive, so that repeated
+    requests to a host don't need a new TCP+TLS handshake each time.
+    (The number of parallel requests per host is limited by the
+    Fetcher.)
+    """
+    global _session, _session_pid
+    with _session_lock:
+        # forked processes (see scraperpool) must not share sockets:
+        if _session is None or _session_pid != os.getpid():
+            _session = new_session()
+            _session_pid = os.getpid()
+        return _session
+
+def new_session():
+    settings = dict(HTTP_DEFAULTS, **config.get('http', {}))
+    retry = Retry(total=settings['retries'],
+                  backoff_factor=settings['backoff_factor'],
+                  status_forcelist=settings['retry_statuses'],
+                  allowed_methods=['HEAD', 'GET'],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=settings['pool_connections'],
+                          pool_maxsize=settings['pool_maxsize'],
+                          # waiting for a free connection could take
+                          # forever if one is never returned; instead,
+                          # extra connections are opened if necessary:
+                          pool_block=False,
+                          max_retries=retry)
+    s = requests.Session()
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    s.headers.update(HEADERS)
+    return s
 
 def normalize_url(url):
     url = url.split('#')[0]
     """normalize ~ vs %7e etc. and strip local anchors #foo"""
     return requests.utils.requote_uri(url)
 
-def request_url(url, if_modified_since=None, etag=None, timeout=10, maxsize=10000000, maxredirects=5):
+# bytes read at a time from http responses:
+CHUNK_SIZE = 64*1024
+
+def request_url(url, if_modified_since=None, etag=None, timeout=10, maxsize=10000000, maxredirects=5,
+                download_dir=None):
     """
     fetches url, returns (status, response_object), where
-    response_object has an additional 'filetype' field
+    response_object has additional 'filetype' and 'size' fields.
+
+    If <download_dir> is given, the body of non-html responses is not
+    held in memory but written to a file in that directory, whose path
+    is stored in response_object.localfile; its md5 hash is stored in
+    response_object.filehash. Use mapped_content() to access the bytes.
     """
-    headers = {
-        # Emulate a web browser profile:
-        'user-agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:37.0) Gecko/20100101 Firefox/37.0',
-        'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'accept-language': 'en-US,en;q=0.5'
-    }
+    headers = {}
     if if_modified_since:
         headers['if-modified-since'] = if_modified_since
     if etag:
         headers['if-none-match'] = etag
+    localfile = None
     try:
         # using stream to respect maxsize and load timeouts, see
         # http://stackoverflow.com/questions/22346158/
-        r = requests.get(url, headers=headers, timeout=timeout, stream=True)
+        r = session().get(url, headers=headers, timeout=timeout, stream=True)
         if int(r.headers.get('Content-Length', 0)) > maxsize:
+            r.close()
             return 903, None
+        if r.status_code != 200:
+            r.close()
+            return r.status_code, r
+        if download_dir:
+            fd, localfile = tempfile.mkstemp(dir=download_dir, suffix='.part')
+            out = os.fdopen(fd, 'wb')
+        else:
+            out = io.BytesIO()
         size = 0
         start = time.time()
-        content = b''
-        for chunk in r.iter_content(1024):
-            if time.time() - start > timeout:
-                r.close()
-                raise requests.exceptions.Timeout
-            size += len(chunk)
-            content += chunk
-            if size > maxsize:
-                r.close()
-                return 903, None
-        if r.status_code == 200:
-            r._content = content
-            r.filetype = request_filetype(r)
-            if meta_redirect(r) and maxredirects > 0:
-                return request_url(r.redirect_url,
-                                   if_modified_since=if_modified_since,
-                                   etag=etag,
-                                   timeout=timeout,
-                                   maxsize=maxsize,
-                                   maxredirects=maxredirects-1)
+        md5 = hashlib.md5()
+        head = None
+        with out:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                if time.time() - start > timeout:
+                    r.close()
+                    raise requests.exceptions.Timeout
+                size += len(chunk)
+                if size > maxsize:
+                    r.close()
+                    if localfile:
+                        os.remove(localfile)
+                    return 903, None
+                if head is None:
+                    head = chunk
+                out.write(chunk)
+                md5.update(chunk)
+            if not localfile:
+                r._content = out.getvalue()
+        r.size = size
+        r.filehash = md5.hexdigest()
+        r.filetype = request_filetype(r, head=head or b'')
+        r.localfile = None
+        if localfile:
+            if r.filetype == 'html':
+                # we need the text of html pages anyway:
+                with open(localfile, 'rb') as f:
+                    r._content = f.read()
+                os.remove(localfile)
+            else:
+                r._content = None
+                r.localfile = localfile
+        if meta_redirect(r) and maxredirects > 0:
+            return request_url(r.redirect_url,
+                               if_modified_since=if_modified_since,
+                               etag=etag,
+                               timeout=timeout,
+                               maxsize=maxsize,
+                               maxredirects=maxredirects-1,
+                               download_dir=download_dir)
         return r.status_code, r
     except requests.exceptions.Timeout:
-        return 408, None
+        status = 408
     except requests.exceptions.TooManyRedirects:
-        return 902, None
+        status = 902
     except requests.exceptions.RequestException as e:
         print('requests connection failed: {}'.format(e))
-        return 905, None
+        status = 905
     except Exception as e:
         print('uncaught requests exception: {}'.format(e))
         print(e)
         # raise?
-        return 900, None
+        status = 900
+    if localfile and os.path.exists(localfile):
+        os.remove(localfile)
+    return status, None
+
+def mapped_content(r):
+    """
+    return read-only view of the body of response <r>: a memory map
+    of r.localfile for downloads that were written to disk, otherwise
+    r.content. Memory maps should be closed after use (they can be
+    used in with statements).
+    """
+    if not getattr(r, 'localfile', None):
+        return memoryview(r.content or b'')
+    with open(r.localfile, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b'')
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-def request_filetype(r):
+def request_filetype(r, head=None):
+    """
+    guess filetype of response <r>; <head> are the first bytes of the
+    body (defaults to r.content)
+    """
     def normalize(ft):
         ft = ft.lower()
         if ft in ('msword', 'docx'): return 'doc'
@@ -81,7 +201,9 @@ def request_filetype(r):
     if m:
         return normalize(m.group(0))
     # for others, first check if content has pdf signature:
-    if r.content.startswith(b'%PDF-'):
+    if head is None:
+        head = r.content
+    if head.startswith(b'%PDF-'):
         return 'pdf'
     # otherwise use file-ending, if it is a 2-4 character string:
     m = re.search('/.+/.+\.([A-Za-z]{2,4})$', r.url)
@@ -113,16 +235,9 @@ def meta_redirect(r):
 
 def get_http_status(url, timeout=10):
     """returns http status from <url>"""
-    headers = {
-        # Emulate a web browser profile:
-        'user-agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:37.0) Gecko/20100101 Firefox/37.0',
-        'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'accept-language': 'en-US,en;q=0.5'
-    }
     try:
-        # using stream to respect maxsize and load timeouts, see
-        # http://stackoverflow.com/questions/22346158/
-        r = requests.get(url, headers=headers, timeout=timeout, stream=True)
+        # using stream so that we don't download the body:
+        r = session().get(url, timeout=timeout, stream=True)
         r.close()
         return r.status_code
     except requests.exceptions.Timeout:
@@ -158,14 +273,72 @@ def text_content(xmlfile):
     return sanitized paper content from pdf2xml output: xml tags
     stripped, words broken ataround line-ends joined.
     '''
+    return text_pages(xmlfile)[0]
+
+def text_pages(xmlfile):
+    '''
+    return (text, numwords, page_offsets) for pdf2xml output <xmlfile>,
+    where text is as for text_content and page_offsets[i] is the
+    position in text at which page i+1 of the xml begins. The file is
+    read one page at a time, so that large documents don't need to be
+    held in memory twice.
+    '''
+    parts = []
+    offsets = []
+    pos = 0
+    numwords = 0
+    pending = None # text of last page, may still change if it ends with a hyphen
+    for page in _xml_pages(xmlfile):
+        text = _page_text(page)
+        if pending is None:
+            pending = text
+            continue
+        if pending.endswith(('-\n', '—\n')):
+            # join word hyphenated across pages:
+            m = _hyphen_rest_re.match(text)
+            if m:
+                pending = pending[:-2] + m.group(1) + '\n'
+                text = text[m.end():]
+        offsets.append(pos)
+        parts.append(pending)
+        pos += len(pending)
+        numwords += len(pending.split())
+        pending = text
+    if pending is not None:
+        offsets.append(pos)
+        parts.append(pending)
+        numwords += len(pending.split())
+    return ''.join(parts), numwords, offsets
+
+_text_re = re.compile('<text.+?>(.+?)</text>', re.DOTALL)
+_tag_re = re.compile(r'</?\w.*?>')
+_hyphen_re = re.compile(r'[-—]\n(\w\S+)\s')
+_hyphen_rest_re = re.compile(r'(\w\S+)\s')
+_page_start_re = re.compile(r'(?=<page[\s>])')
+
+def _xml_pages(xmlfile):
+    """yield the xml of the successive <page> elements in <xmlfile>"""
     with open(xmlfile, 'r', encoding='utf-8') as f:
-        xml = f.read()
-        text = ''
-        textre = re.compile('<text.+?>(.+?)</text>', re.DOTALL)
-        for m in textre.finditer(xml):
-            text += m.group(1) + '\n'
-        # strip <sub>, <b>, etc.:
-        text = re.sub('</?\w.*?>', '', text)
-        # join hyphenated words:
-        text = re.sub('[-—]\n(\w\S+)\s', r'\1\n', text)
-        return text
+        buf = []
+        started = False
+        for line in f:
+            if '<page' not in line:
+                buf.append(line)
+                continue
+            chunks = _page_start_re.split(line)
+            buf.append(chunks[0])
+            for chunk in chunks[1:]:
+                if started:
+                    yield ''.join(buf)
+                # anything before the first page is the xml header:
+                started = True
+                buf = [chunk]
+        if started:
+            yield ''.join(buf)
+
+def _page_text(xml):
+    text = ''.join(m.group(1) + '\n' for m in _text_re.finditer(xml))
+    # strip <sub>, <b>, etc.:
+    text = _tag_re.sub('', text)
+    # join hyphenated words:
+    return _hyphen_re.sub(r'\1\n', text)
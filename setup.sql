@@ -11,9 +11,16 @@ CREATE TABLE sources (
   last_checked DATETIME DEFAULT NULL,
   default_author VARCHAR(128) DEFAULT NULL,
   name VARCHAR(128) DEFAULT NULL,
+  lease_token CHAR(32) DEFAULT NULL,
+  lease_expires DATETIME DEFAULT NULL,
+  change_rate FLOAT DEFAULT NULL,
+  next_check DATETIME DEFAULT NULL,
+  js_required TINYINT(1) DEFAULT NULL,
   PRIMARY KEY (source_id),
   UNIQUE KEY (urlhash),
-  KEY (last_checked)
+  KEY (last_checked),
+  KEY (lease_token),
+  KEY (next_check)
 ) ENGINE=InnoDB CHARACTER SET utf8mb4;
 
 DROP TABLE IF EXISTS links;
@@ -62,6 +69,22 @@ CREATE TABLE docs (
   KEY (found_date)
 ) ENGINE=InnoDB CHARACTER SET utf8mb4;
 
+DROP TABLE IF EXISTS docs_minhash;
+CREATE TABLE docs_minhash (
+  doc_id INT(11) UNSIGNED NOT NULL,
+  signature VARBINARY(512) NOT NULL,
+  PRIMARY KEY (doc_id)
+) ENGINE=InnoDB;
+
+DROP TABLE IF EXISTS docs_minhash_bands;
+CREATE TABLE docs_minhash_bands (
+  band TINYINT UNSIGNED NOT NULL,
+  bucket BIGINT NOT NULL,
+  doc_id INT(11) UNSIGNED NOT NULL,
+  PRIMARY KEY (band, bucket, doc_id),
+  KEY (doc_id)
+) ENGINE=InnoDB;
+
 DROP TABLE IF EXISTS cats;
 CREATE TABLE cats (
   cat_id INT(11) UNSIGNED NOT NULL auto_increment,
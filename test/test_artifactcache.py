@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import pytest
+import os
+import time
+from opp import artifactcache
+from opp.config import config
+
+@pytest.fixture
+def cachedir(tmpdir, monkeypatch):
+    d = str(tmpdir.mkdir('cache'))
+    monkeypatch.setitem(config, 'artifact_cache', {'dir': d, 'max_mb': 1})
+    if hasattr(artifactcache.put, 'size'):
+        del artifactcache.put.size
+    return d
+
+def make_file(tmpdir, name, size):
+    path = str(tmpdir.join(name))
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+def test_put_get(tmpdir, cachedir):
+    src = make_file(tmpdir, 'a.pdf', 1000)
+    h = artifactcache.file_hash(src)
+    assert artifactcache.get(h, 'original.pdf') is None
+    artifactcache.put(h, 'original.pdf', src)
+    dest = str(tmpdir.join('b.pdf'))
+    assert artifactcache.get(h, 'original.pdf', dest=dest) == dest
+    assert artifactcache.file_hash(dest) == h
+
+def test_json(cachedir):
+    artifactcache.put_json('abcdef', 'extractor', {'title': 'Foo'})
+    assert artifactcache.get_json('abcdef', 'extractor') == {'title': 'Foo'}
+    assert artifactcache.get_json('abcdef', 'other') is None
+
+def test_eviction(tmpdir, cachedir):
+    hashes = []
+    for i in range(5):
+        src = make_file(tmpdir, '{}.pdf'.format(i), 300*1024)
+        h = artifactcache.file_hash(src)
+        artifactcache.put(h, 'original.pdf', src)
+        t = time.time() - 100 + i
+        os.utime(artifactcache.entry_dir(h), (t, t))
+        hashes.append(h)
+    assert artifactcache.cache_size() <= 1024*1024
+    # most recently used entry survives, oldest is gone:
+    assert artifactcache.get(hashes[-1], 'original.pdf')
+    assert not artifactcache.get(hashes[0], 'original.pdf')
@@ -49,6 +49,31 @@ def test_reuse(caplog):
     assert b1 == b2
     stop_browser()
 
+def test_recycle(caplog):
+    caplog.setLevel(logging.CRITICAL, logger='selenium')
+    caplog.setLevel(logging.DEBUG, logger='opp')
+    b1 = Browser()
+    assert b1.is_alive()
+    b1.pageloads = 10000
+    b2 = Browser()
+    assert b1 != b2
+    assert b2.pageloads == 0
+    stop_browser()
+
+def test_replace_dead(caplog):
+    caplog.setLevel(logging.CRITICAL, logger='selenium')
+    caplog.setLevel(logging.DEBUG, logger='opp')
+    b1 = Browser()
+    b1.quit()
+    src = 'file://'+testdir+'/umsu.html'
+    with pytest.raises(Exception):
+        b1.goto(src)
+    # the failed page load triggers a liveness probe:
+    b2 = Browser()
+    assert b1 != b2
+    assert b2.is_alive()
+    stop_browser()
+
 def count_processes(procname):
     ps = subprocess.Popen(('ps', 'aux'), stdout=subprocess.PIPE)
     output = ps.communicate()[0]
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import pytest
+import time
+import subprocess
+from opp import budget
+from opp.exceptions import BudgetExceededException
+
+def test_run_without_budget():
+    proc = budget.run(['echo', 'hello'], timeout=5)
+    assert proc.returncode == 0
+    assert proc.stdout == b'hello\n'
+    with pytest.raises(subprocess.TimeoutExpired):
+        budget.run(['sleep', '5'], timeout=0.2)
+
+def test_wall_clock_budget():
+    with budget.document_budget(wall_secs=0.5) as b:
+        start = time.time()
+        with pytest.raises(BudgetExceededException):
+            budget.run(['sleep', '5'], timeout=10)
+        assert time.time() - start < 2
+        assert b.exceeded()
+        # later steps are cancelled right away:
+        with pytest.raises(BudgetExceededException):
+            budget.run(['echo', 'hello'], timeout=5)
+    assert budget.current() is None
+
+def test_cpu_budget():
+    with budget.document_budget(cpu_secs=1) as b:
+        with pytest.raises(BudgetExceededException):
+            budget.run(['python3', '-c', 'while True: pass'], timeout=20)
+        assert b.exceeded()
+
+def test_limits_set_before_exec():
+    # the limits already hold when the tool starts:
+    with budget.document_budget(cpu_secs=10, max_mem_mb=500):
+        proc = budget.run(['sh', '-c', 'ulimit -t; ulimit -v'], timeout=5)
+    cpu, mem = proc.stdout.split()
+    assert int(cpu) <= 11
+    assert int(mem) == 500*1024
+
+def test_cpu_share():
+    # tools running in parallel share the CPU budget:
+    with budget.document_budget(cpu_secs=100):
+        cmd = budget.limited(['sh', '-c', 'ulimit -t'], share=4)
+    assert int(subprocess.check_output(cmd)) <= 26
+
+def test_step_timeout():
+    assert budget.step_timeout(10) == 10
+    with budget.document_budget(wall_secs=3):
+        assert budget.step_timeout(10) <= 3
+        assert budget.step_timeout(1) == 1
@@ -20,3 +20,26 @@ def test_query(caplog):
     cur.execute(query)
     sources = cur.fetchall()
     assert True
+
+def test_threads_get_own_connection():
+    import threading
+    conns = {}
+    def get_conn(i):
+        conns[i] = db.connection()
+    threads = [threading.Thread(target=get_conn, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(id(c) for c in conns.values())) == 3
+    assert db.connection() not in conns.values()
+
+def test_release():
+    conn = db.connection()
+    db.release()
+    assert db.connection() is conn
+
+def test_charset():
+    cur = db.cursor()
+    cur.execute("SELECT @@character_set_connection, @@character_set_client")
+    assert cur.fetchone() == ('utf8mb4', 'utf8mb4')
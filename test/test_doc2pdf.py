@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import pytest
+import os
+from concurrent.futures import ThreadPoolExecutor
+from opp.pdftools.doc2pdf import ListenerPool
+from opp.debug import debuglevel
+
+debuglevel(4)
+
+RTF = r'{\rtf1\ansi\deff0 {\fonttbl {\f0 Times;}} \f0 Hello world, document {}.\par}'
+
+def test_convert(tmpdir):
+    pool = ListenerPool(listeners=2)
+    try:
+        files = []
+        for i in range(3):
+            path = str(tmpdir.join('doc{}.rtf'.format(i)))
+            with open(path, 'w') as f:
+                f.write(RTF.replace('{}', str(i), 1))
+            files.append(path)
+        with ThreadPoolExecutor(2) as ex:
+            pdfs = list(ex.map(lambda f: pool.convert(f, f.replace('.rtf', '.pdf')), files))
+        for pdf in pdfs:
+            with open(pdf, 'rb') as f:
+                assert f.read(5) == b'%PDF-'
+        # a dead listener is restarted:
+        pool.listeners[0].stop()
+        pool.listeners[0].convert(files[0], str(tmpdir.join('again.pdf')))
+        assert os.path.exists(str(tmpdir.join('again.pdf')))
+    finally:
+        pool.close()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import pytest
+import lxml.html
+from opp import domsnapshot
+
+HTML = '''<html><body>
+<ul>
+<li id="a1"><a href="a.pdf">Paper <i>A</i></a>, forthcoming</li>
+<li style="display:none"><a href="b.pdf">Paper B</a> &amp; more</li>
+<li><br>x</li>
+</ul>
+</body></html>'''
+
+def test_from_lxml():
+    dom = domsnapshot.from_lxml(lxml.html.document_fromstring(HTML))
+    assert len(dom.anchors) == 2
+    a, b = dom.anchors
+    assert a.get('href') == 'a.pdf'
+    assert a.text() == 'Paper A'
+    assert a.parent.text() == 'Paper A, forthcoming'
+    assert a.parent.get('id') == 'a1'
+    assert not a.is_hidden()
+    assert b.is_hidden()
+    assert a.outer_html() == '<a href="a.pdf">Paper <i>A</i></a>'
+    assert b.parent.outer_html() == '<li style="display:none"><a href="b.pdf">Paper B</a> &amp; more</li>'
+    ul = a.parent.parent
+    assert [li.tag for li in ul.elements] == ['li', 'li', 'li']
+    assert ul.elements[2].outer_html() == '<li><br>x</li>'
+
+def test_from_browser_format():
+    link = {'href': 'http://x.org/p.pdf', 'text': 'paper', 'visible': True,
+            'box': [0, 10, 50, 20]}
+    arr = ['html', [], 100, 0, None,
+           ['body', [['class', 'x']], 100, 0, None,
+            'hello ',
+            ['a', [['href', 'p.pdf']], 20, 10, link, 'paper']]]
+    dom = domsnapshot.DomSnapshot(domsnapshot._build(arr))
+    assert dom.root.text() == 'hello paper'
+    a = dom.anchors[0]
+    assert (a.height, a.top) == (20, 10)
+    assert a.parent.get('class') == 'x'
+    assert a.link['href'] == 'http://x.org/p.pdf'
+    assert a.index == 0
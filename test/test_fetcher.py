@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+import pytest
+import time
+import threading
+from opp.fetcher import Fetcher
+
+class FakeLink():
+    active = {} # host => number of running requests
+    max_active = {}
+    lock = threading.Lock()
+
+    def __init__(self, url):
+        self.url = url
+        self.host = url.split('/')[2]
+
+    def request(self, url, only_if_modified=True, download_dir=None):
+        with self.lock:
+            self.active[self.host] = self.active.get(self.host, 0) + 1
+            self.max_active[self.host] = max(self.max_active.get(self.host, 0),
+                                             self.active[self.host])
+        time.sleep(0.05)
+        with self.lock:
+            self.active[self.host] -= 1
+        return 200, url
+
+def test_fetch_all():
+    links = [FakeLink('http://host{}.org/{}.pdf'.format(i % 3, i)) for i in range(12)]
+    fetcher = Fetcher(host_concurrency=2, host_delay=0, max_pending=2)
+    results = list(fetcher.fetch_all(links))
+    assert len(results) == 12
+    for li, (status, r) in results:
+        assert status == 200
+        assert r == li.url
+    assert max(FakeLink.max_active.values()) <= 2
+
+def test_host_delay():
+    links = [FakeLink('http://slow.org/{}.pdf'.format(i)) for i in range(3)]
+    fetcher = Fetcher(host_concurrency=3, host_delay=0.2)
+    start = time.time()
+    list(fetcher.fetch_all(links))
+    assert time.time() - start >= 0.4
+
+def test_stop_early():
+    links = [FakeLink('http://host.org/{}.pdf'.format(i)) for i in range(20)]
+    fetcher = Fetcher(host_concurrency=1, host_delay=0, max_pending=1)
+    for li, response in fetcher.fetch_all(links):
+        break
+    # generator must be closed without hanging
+
+def test_error_in_background():
+    class BrokenFetcher(Fetcher):
+        async def _fetch_all(self, *args):
+            raise ValueError('oops')
+    links = [FakeLink('http://host.org/{}.pdf'.format(i)) for i in range(3)]
+    with pytest.raises(ValueError):
+        # must raise instead of waiting forever for the results:
+        list(BrokenFetcher().fetch_all(links))
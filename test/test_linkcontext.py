@@ -5,6 +5,7 @@ import os.path
 import sys
 from opp.models import Link
 from opp.browser import Browser
+from opp import domsnapshot
 from opp.debug import debuglevel
 
 VDISPLAY = True
@@ -96,10 +97,11 @@ def test_linkcontext(page, link, context, caplog):
     debuglevel(5)
     curpath = os.path.abspath(os.path.dirname(__file__))
     testdir = os.path.join(curpath, 'sourcepages')
-    browser = Browser(reuse_browser=True, use_virtual_display=VDISPLAY)
+    browser = Browser()
     src = 'file://'+testdir+'/'+page
     browser.goto(src)
-    el = browser.find_elements_by_xpath('//a[@href="{}"]'.format(link))[0]
-    li = Link(element=el)
+    dom = domsnapshot.from_browser(browser)
+    node = [a for a in dom.anchors if a.get('href') == link][0]
+    li = Link(node=node)
     res = li.html_context()
     assert res == context
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import pytest
+import os.path
+from opp import minhash
+
+curpath = os.path.abspath(os.path.dirname(__file__))
+testdir = os.path.join(curpath, 'testdocs')
+
+def readfile(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def test_signature():
+    text = readfile(os.path.join(testdir, 'attitudes.txt'))
+    sig = minhash.signature(text)
+    assert len(sig) == minhash.NUM_HASHES
+    assert (minhash.signature(text) == sig).all()
+    assert minhash.signature('too short') is None
+
+def test_similarity():
+    text = readfile(os.path.join(testdir, 'attitudes.txt'))
+    other = readfile(os.path.join(testdir, 'cv.txt'))
+    sig = minhash.signature(text)
+    # revised version with a new beginning:
+    sig2 = minhash.signature('A different abstract. ' * 20 + text[len(text)//10:])
+    sig3 = minhash.signature(other)
+    assert minhash.similarity(sig, sig2) > 0.6
+    assert minhash.similarity(sig, sig3) < 0.1
+    shared_bands = set(minhash.band_keys(sig)) & set(minhash.band_keys(sig2))
+    assert len(shared_bands) > 10
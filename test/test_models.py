@@ -4,10 +4,10 @@ import logging
 import os.path
 import sys
 import json
-from datetime import datetime
-from opp.models import Source, Link, Doc
+from datetime import datetime, timedelta
+from opp.models import Source, Link, Doc, unit_of_work, mark_clean, dirty_fields
 from opp.debug import debuglevel
-from opp import db
+from opp import db, domsnapshot
 
 """
 To run these tests, create a test database called test_opp and
@@ -27,7 +27,7 @@ def testdb():
     db.close()
     db.connection(db='test_opp')
     cur = db.cursor()
-    for t in ('sources', 'links', 'docs'):
+    for t in ('sources', 'links', 'docs', 'docs_minhash', 'docs_minhash_bands'):
         cur.execute('DELETE FROM {}'.format(t))
     db.commit()
     Source(
@@ -66,3 +66,119 @@ def test_Doc(testdb):
     doc2.load_from_db()
     assert doc2.authors == 'wo'
 
+
+def test_Source_revisit_schedule():
+    src = Source(url='http://umsu.de/papers/', status=1)
+    assert src.revisit_hours() == 12 / Source.CHANGE_RATE_PRIOR
+    assert src.revisit_hours(status=404) == Source.REVISIT_BROKEN_HOURS
+    # frequently changing page:
+    src.last_checked = datetime.now() - timedelta(hours=6)
+    for i in range(100):
+        src.update_change_rate(1)
+    assert src.revisit_hours() == Source.REVISIT_MIN_HOURS
+    # page that never changes:
+    src.last_checked = datetime.now() - timedelta(days=14)
+    for i in range(20):
+        src.update_change_rate(0)
+    assert src.revisit_hours() == Source.REVISIT_MAX_HOURS
+
+def test_Source_old_link(testdb):
+    src = Source(url='http://umsu.de/papers/')
+    src.load_from_db()
+    Link(source_id=src.source_id, url='http://umsu.de/papers/old.pdf').update_db()
+    src.set_html('<html><body></body></html>')
+    assert src.old_link('http://umsu.de/papers/old.pdf')
+    li = src.old_link('https://www.umsu.de/papers/old.pdf')
+    assert li and li.url == 'https://www.umsu.de/papers/old.pdf'
+    assert src.old_link('https://www.umsu.de/papers/old.pdf') is li
+    assert src.old_link('http://umsu.de/papers/new.pdf') is None
+
+def test_anchors_static_and_browser():
+    src = Source(url='http://umsu.de/papers/')
+    src.set_html('<html><body><a href="a.pdf#page=2">A</a>'
+                 ' <a href="/~wo/b%7e.pdf">B</a> <a href="c d.pdf">C</a></body></html>')
+    src.dom = domsnapshot.from_lxml(src.lxmldoc())
+    static = [href for (node, href, text) in src.anchors()]
+    # the browser reports the hrefs resolved by itself:
+    links = ['http://umsu.de/papers/a.pdf#page=2', 'http://umsu.de/~wo/b%7e.pdf',
+             'http://umsu.de/papers/c%20d.pdf']
+    arr = ['html', [], 100, 0, None,
+           ['body', [], 100, 0, None] +
+           [['a', [], 20, 10, {'href': href, 'text': 'x', 'visible': True,
+                               'box': [0, 10, 50, 20]}, 'x'] for href in links]]
+    src.dom = domsnapshot.DomSnapshot(domsnapshot._build(arr))
+    browser = [href for (node, href, text) in src.anchors()]
+    assert static == browser
+
+def test_url_variant_key():
+    assert Source.url_variant_key('https://www.umsu.de/papers/') == 'umsu.de/papers'
+    assert Source.url_variant_key('http://a.com/x//paper.pdf') == 'a.com/x//paper.pdf'
+    assert (Source.url_variant_key('http://a.com/x//paper.pdf')
+            != Source.url_variant_key('http://b.org/y//paper.pdf'))
+
+def test_unit_of_work(testdb):
+    with unit_of_work():
+        li = Link(source_id=1, url='http://umsu.de/papers/uow1.pdf')
+        li.update_db(filesize=1)
+        assert li.link_id > 0
+    li2 = Link(source_id=1, url='http://umsu.de/papers/uow1.pdf')
+    li2.load_from_db()
+    assert li2.link_id == li.link_id
+
+def test_unit_of_work_rollback(testdb):
+    with pytest.raises(ValueError):
+        with unit_of_work():
+            li = Link(source_id=1, url='http://umsu.de/papers/uow2.pdf')
+            li.update_db(filesize=1)
+            with unit_of_work():
+                doc = Doc(url='http://umsu.de/papers/uow2.pdf')
+                doc.update_db()
+            raise ValueError()
+    assert li.link_id == 0
+    assert doc.doc_id == 0
+    li2 = Link(source_id=1, url='http://umsu.de/papers/uow2.pdf')
+    li2.load_from_db()
+    assert not li2.link_id
+
+def test_dirty_fields():
+    doc = Doc(doc_id=5, url='http://umsu.de/papers/x.pdf', content='foo',
+              found_date=datetime(2020,1,1,12,0,0,123))
+    assert dirty_fields(doc, {'content': 'foo'}) == {'content': 'foo'}
+    mark_clean(doc)
+    assert dirty_fields(doc, {'content': 'foo', 'title': ''}) == {}
+    assert dirty_fields(doc, {'content': 'bar'}) == {'content': 'bar'}
+    assert dirty_fields(doc, {'found_date': datetime(2020,1,1,12,0,0)}) == {}
+
+def test_Doc_unchanged(testdb, monkeypatch):
+    doc = Doc(url='http://umsu.de/papers/unchanged.pdf', content='foo')
+    doc.update_db()
+    doc2 = Doc(doc_id=doc.doc_id)
+    doc2.load_from_db()
+    with monkeypatch.context() as m:
+        # no query must be sent for an unchanged doc:
+        m.setattr(db, 'cursor', None)
+        doc2.update_db()
+    doc2.update_db(title='Unchanged')
+    doc3 = Doc(doc_id=doc.doc_id)
+    doc3.load_from_db()
+    assert doc3.title == 'Unchanged'
+
+def test_Link_save_all(testdb):
+    old = Link(source_id=1, url='http://umsu.de/papers/bulk0.pdf')
+    old.update_db(status=0, filesize=99)
+    links = [Link(source_id=1, url='http://umsu.de/papers/bulk{}.pdf'.format(i))
+             for i in range(3)]
+    Link.save_all(links, status=1)
+    assert links[0].link_id == old.link_id
+    assert all(li.link_id > 0 for li in links)
+    assert len(set(li.link_id for li in links)) == 3
+    li = Link(source_id=1, url='http://umsu.de/papers/bulk0.pdf')
+    li.load_from_db()
+    assert li.status == 1
+    assert li.filesize == 99
+
+def test_Link_urlhash(testdb):
+    cur = db.cursor()
+    url = 'http://umsu.de/papers/ümlaut.pdf'
+    cur.execute("SELECT MD5(%s)", (url,))
+    assert cur.fetchone()[0] == Link.urlhash(url)
@@ -142,3 +142,15 @@ def test_mongin_title(monginpdf, caplog):
     assert monginpdf.get_element('greatly exaggerated', page=1) is not None
 
 
+
+def test_pages_in_ranges():
+    assert ocr2xml.pages_in_ranges([(1,3), (7,8)]) == [1,2,3,7,8]
+    assert ocr2xml.pages_in_ranges([(1,3), (2,4)]) == [1,2,3,4]
+
+def test_selected_pages(tmpdir):
+    pdffile = os.path.join(testdir, 'carnap-long.pdf')
+    xmlfile = str(tmpdir.join('carnap.xml'))
+    ocr2xml.ocr2xml(pdffile, xmlfile, pages=[1,3])
+    with open(xmlfile, 'rb') as f:
+        xml = lxml.etree.fromstring(f.read())
+    assert len(xml.xpath('//page')) == 2
@@ -4,8 +4,9 @@ import logging
 import os.path
 import os, sys, shutil
 import json
+import subprocess
 from opp import scraper
-from opp.docparser import paperparser
+from opp.docparser import paperparser, extractorpool
 
 curpath = os.path.abspath(os.path.dirname(__file__))
 testdir = os.path.join(curpath, 'testdocs')
@@ -35,3 +36,47 @@ def test_extractor():
     xmlfile = os.path.join(testdir, 'simple.xml')
     jsonres = paperparser.extractor(xmlfile)
     assert jsonres and 'authors' in jsonres
+
+def test_extractor_pool():
+    xmlfile = os.path.join(testdir, 'simple.xml')
+    pool = extractorpool.ExtractorPool(workers=1, max_jobs=2)
+    try:
+        assert 'authors' in pool.extract(xmlfile)
+        pid = pool.workers[0].process.pid
+        assert 'authors' in pool.extract(xmlfile)
+        assert pool.workers[0].process.pid == pid
+        # recycled after max_jobs:
+        assert 'authors' in pool.extract(xmlfile)
+        assert pool.workers[0].process.pid != pid
+    finally:
+        pool.close()
+
+def test_extractor_context():
+    xmlfile = os.path.join(testdir, 'simple.xml')
+    pool = extractorpool.ExtractorPool(workers=1)
+    context = { 'url': 'http://example.org/test.pdf', 'anchortext': 'Example',
+                'linkcontext': 'Example context', 'sourceauthor': 'Hans Kamp' }
+    source = { 'sourcecontent': 'Hello' }
+    try:
+        assert pool.extract(xmlfile, context, source, 'http://example.org/')
+        assert pool.workers[0].source_key == 'http://example.org/'
+        assert pool.extract(xmlfile, context, source, 'http://example.org/')
+    finally:
+        pool.close()
+
+def test_extractor_pool_separates_documents():
+    # a worker must not reuse anything from earlier documents:
+    xmlfiles = [os.path.join(testdir, f) for f in ('simple.xml', 'carnap-short.xml')]
+    pool = extractorpool.ExtractorPool(workers=1)
+    try:
+        results = [pool.extract(xmlfile) for xmlfile in xmlfiles + xmlfiles]
+    finally:
+        pool.close()
+    for xmlfile, res in zip(xmlfiles + xmlfiles, results):
+        assert res == standalone_extract(xmlfile)
+
+def standalone_extract(xmlfile):
+    """run Extractor.pm on <xmlfile> in a fresh perl process"""
+    out = subprocess.check_output([extractorpool.PERL, extractorpool.EXTRACTOR, xmlfile])
+    res = out.decode('utf-8').split('=========== RESULT ===========\n')[-1]
+    return json.loads(res)
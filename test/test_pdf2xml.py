@@ -48,3 +48,15 @@ def test_mongin_ocr(caplog):
     with open(xmlfile, 'r') as f:
         xml = f.read()
         assert 'travail reexamine' in xml
+
+def test_merge_xml():
+    head = ('<pdf2xml>\n<page number="1">\n<fontspec id="0" size="12"/>\n'
+            '<fontspec id="1" size="9"/>\n<text top="1" font="1">a</text>\n</page>\n</pdf2xml>\n')
+    tail = ('<pdf2xml>\n<page number="99">\n<fontspec id="0" size="10"/>\n'
+            '<text top="1" font="0">z</text>\n</page>\n</pdf2xml>\n')
+    xml = pdf2xml.merge_xml([head, tail])
+    assert xml.count('<pdf2xml>') == 1
+    assert xml.index('page number="1"') < xml.index('page number="99"')
+    assert '<fontspec id="2" size="10"/>' in xml
+    assert '<text top="1" font="2">z</text>' in xml
+    assert xml.rstrip().endswith('</pdf2xml>')
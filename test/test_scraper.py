@@ -28,7 +28,7 @@ def testdb():
     db.close()
     db.connection(db='test_opp')
     cur = db.cursor()
-    for t in ('sources', 'links', 'docs'):
+    for t in ('sources', 'links', 'docs', 'docs_minhash', 'docs_minhash_bands'):
         cur.execute('DELETE FROM {}'.format(t))
     db.commit()
     Source(
@@ -49,9 +49,16 @@ def test_debug(caplog):
     assert 'secret' not in caplog.text()
     debuglevel(5)
 
-def test_next_source(testdb):
-    src = scraper.next_source()
+def test_claim_sources(testdb):
+    sources = scraper.claim_sources(1, lease_secs=60)
+    src = sources[0]
     assert src.url == 'http://consc.net/papers.html'
+    src.renew_lease(3600)
+    cur = db.cursor()
+    query = "SELECT lease_expires > NOW() + INTERVAL 30 MINUTE FROM sources WHERE source_id = %s"
+    cur.execute(query, (src.source_id,))
+    assert cur.fetchone()[0]
+    src.release_lease()
 
 def test_check_steppingstone():
     examples = [
@@ -86,6 +93,13 @@ def test_get_duplicate(testdb):
     doc2.title = 'Lost memories and useless coins: revisiting the absentminded driver'
     dupe = scraper.get_duplicate(doc2)
     assert dupe.doc_id == doc.doc_id
+    # similar content alone isn't enough:
+    doc3 = Doc(url='http://example.org/other.pdf')
+    doc3.content = doc2.content
+    doc3.numwords = 14130
+    doc3.authors = 'Jane Doe'
+    doc3.title = 'An entirely different paper'
+    assert scraper.get_duplicate(doc3) is None
 
 @pytest.mark.parametrize(('published','context'), [
     (1, 'Basic structure and the value of equality, Philosophy and public affairs, 31: 4, 2003'),
@@ -114,6 +128,23 @@ def test_process_file():
     scraper.process_file(doc)
     assert doc.title == 'Lorem ipsum dolor sit amet'
 
+def test_triage():
+    doc = Doc(url='http://umsu.de/papers/driver-2011.pdf', filetype='pdf')
+    doc.link = Link(url=doc.url)
+    doc.link.context = 'Lost memories and useless coins: Revisiting the absentminded driver'
+    doc.link.anchortext = 'Lost memories and useless coins'
+    doc.tempfile = os.path.join(testdir, 'attitudes.pdf')
+    assert scraper.triage(doc)
+    # without text layer, triage doesn't reject:
+    doc.tempfile = os.path.join(testdir, 'needsocr.pdf')
+    assert scraper.triage(doc)
+
+def test_page_windows():
+    assert scraper.page_windows(30) is None
+    head = scraper.LARGE_PDF['head_pages']
+    tail = scraper.LARGE_PDF['tail_pages']
+    assert scraper.page_windows(500) == [(1, head), (501-tail, 500)]
+
 def test_process_link(testdb, caplog):
     source = Source(url='http://umsu.de/papers/')
     source.load_from_db()
@@ -11,6 +11,29 @@ def test_text_content():
     assert 'sys-' not in content
     assert 'systems' in content
 
+def test_text_pages():
+    curpath = os.path.abspath(os.path.dirname(__file__))
+    testdoc = os.path.join(curpath, 'testdocs', 'bennett-ocr.xml')
+    text, numwords, offsets = util.text_pages(testdoc)
+    assert text == util.text_content(testdoc)
+    assert numwords == len(text.split())
+    assert len(offsets) == 9
+    assert offsets[0] == 0
+    assert offsets == sorted(offsets)
+    assert text[offsets[1]-1] == '\n'
+
+def test_text_pages_hyphen_across_pages(tmpdir):
+    xmlfile = str(tmpdir.join('doc.xml'))
+    with open(xmlfile, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0"?>\n<pdf2xml>\n'
+                '<page number="1">\n<text top="1">first page ends with a hyph-</text>\n</page>\n'
+                '<page number="2">\n<text top="1">enated word here</text>\n</page>\n'
+                '</pdf2xml>\n')
+    text, numwords, offsets = util.text_pages(xmlfile)
+    assert 'hyphenated\n' in text
+    assert numwords == 8
+    assert text[offsets[1]:] == 'word here\n'
+
 def test_request_url():
     (status, r) = util.request_url('http://umsu.de/')
     assert status == 200
@@ -26,3 +49,22 @@ def test_request_url_maxsize():
     assert status == 903
 
 # TODO: more tests
+
+def test_session():
+    s = util.session()
+    assert util.session() is s
+    assert 'Mozilla' in s.headers['user-agent']
+    assert s.get_adapter('https://philpapers.org/')._pool_block
+
+def test_mapped_content(tmpdir):
+    class Response():
+        content = None
+    r = Response()
+    r.localfile = str(tmpdir.join('x.pdf'))
+    with open(r.localfile, 'wb') as f:
+        f.write(b'%PDF-1.4 hello')
+    with util.mapped_content(r) as m:
+        assert m[:5] == b'%PDF-'
+    r.localfile = None
+    r.content = b'<html>'
+    assert bytes(util.mapped_content(r)) == b'<html>'